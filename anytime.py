@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+from approximation_algorithms import FFDH
+from strip import Strip, Problem
+import time
+
+def parse_duration(text: str) -> float:
+    '''Parses durations like `30`, `30s`, `2m` or `1h` into seconds'''
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    if (text and text[-1] in units):
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+def solve(solver, problem: Problem, time_limit: float, **kwargs) -> Strip:
+    '''
+    Runs an anytime solver (a generator of ever better Strips that takes a
+    `deadline`) for at most `time_limit` seconds and returns the best strip
+    found. FFDH seeds the incumbent, so there is always a result.
+
+    Every new incumbent is printed with its height and elapsed time.
+    '''
+    start = time.time()
+    deadline = start + time_limit
+
+    def report(strip: Strip, source: str):
+        print(f'Incumbent: height {strip.total_height} after {time.time() - start:.2f} seconds ({source})', flush=True)
+
+    best = FFDH(problem)
+    report(best, 'FFDH')
+
+    for strip in solver(problem, deadline=deadline, **kwargs):
+        if (strip.total_height < best.total_height):
+            best = strip
+            report(best, 'search')
+
+        if (time.time() >= deadline):
+            break
+
+    return best
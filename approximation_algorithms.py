@@ -1,51 +1,180 @@
 #!/usr/bin/env python3
 
 from strip import Strip, Problem
+from contour import Contour
+from skyline import Skyline
+import bisect
+import heapq
+import numpy as np
 import random
 import copy
 
 def BL(problem: Problem, order=None) -> Strip:
     '''Bottom-up left-justified'''
     strip = Strip(problem, None)
+    contour = Contour(strip.width)
 
     if order is None:
-        order = random.sample(strip.unplaced, k = len(strip.unplaced))
+        order = random.sample(list(strip.unplaced), k = len(strip.unplaced))
     
-    i = 0
-    while i < len(order):
-        id = order[i]
-        x = 0
-        y = 0
-
-        while (not strip.is_valid_placement(id, (x, y))):
-            x += 1
-            if (x == strip.width):
-                x = 0
-                y += 1
+    for id in order:
+        box = strip.boxes[id]
+        pos = contour.bottom_left(box.width, box.height)
+        contour.fill(pos, box.width, box.height)
+        strip.place(id, pos)
+
+    return strip
+
+class ShelfTree:
+    '''
+    Max segment tree over the residual widths of shelves, in the order the
+    shelves were opened, so the first shelf with room for a box is found in
+    O(log n) instead of trying every shelf. Unused leaves hold -1.
+    '''
+    def __init__(self) -> None:
+        self.size = 16
+        self.tree = [-1] * (2 * self.size)
+        self.count = 0
+
+    def append(self, residual: int) -> int:
+        if (self.count == self.size):
+            leaves = self.tree[self.size:]
+            self.size *= 2
+            self.tree = [-1] * self.size + leaves + [-1] * (self.size - len(leaves))
+            for i in range(self.size - 1, 0, -1):
+                self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+
+        i = self.count
+        self.count += 1
+        self.update(i, residual)
+        return i
+
+    def update(self, i: int, residual: int) -> None:
+        tree = self.tree
+        i += self.size
+        tree[i] = residual
+        i //= 2
+        while i:
+            left = tree[2 * i]
+            right = tree[2 * i + 1]
+            best = left if left > right else right
+            if (tree[i] == best):
+                break
+            tree[i] = best
+            i //= 2
+
+    def first_fit(self, width: int, start=0) -> int | None:
+        '''Returns the first shelf at or after `start` with a residual width of at least `width`'''
+        if (start >= self.count):
+            return None
+
+        tree = self.tree
+        if (start == 0):
+            if (tree[1] < width):
+                return None
+            i = 1
+        else:
+            i = start + self.size
+
+        # climb until the current node, or a right sibling, may hold a fit
+        while tree[i] < width:
+            while i & 1:
+                i //= 2
+                if (i == 0):
+                    return None
+            i += 1
+
+        # then descend to its leftmost leaf that fits
+        while i < self.size:
+            i *= 2
+            if (tree[i] < width):
+                i += 1
+
+        return i - self.size
+
+def first_fit_shelves(strip: Strip, ids: list[int], shelves: dict, contour: Contour = None) -> None:
+    '''
+    First-fit over shelves, placing ids from the end of the list first.
+
+    `shelves` maps each shelf's y to [next open x, height], in increasing y,
+    and is updated in place; when no shelf fits, a new one opens on top of the
+    last. The residual widths rule shelves out. Without a contour, boxes come
+    tallest first and a box always fits at the next open x of the first shelf
+    with room. With a contour, the box goes at the leftmost free x on that
+    shelf instead, which lets boxes taller than the shelf use free space in
+    the shelf above (SF's narrow phase).
+    '''
+    ys = list(shelves)
+    index = ShelfTree()
+    for info in shelves.values():
+        index.append(strip.width - info[0])
+
+    # shelves where a box of the current height didn't fit; the contour only
+    # fills up, so no wider box of that height fits there either
+    capped = []
+    capped_height = None
+
+    widths = strip.widths.tolist()
+    heights = strip.heights.tolist()
+    while (ids):
+        id = ids.pop()
+        w = widths[id]
+        h = heights[id]
+
+        if (h != capped_height):
+            for i in capped:
+                index.update(i, strip.width - shelves[ys[i]][0])
+            capped = []
+            capped_height = h
+
+        i = index.first_fit(w)
+        while i is not None:
+            y = ys[i]
+            if (contour is None):
+                x = shelves[y][0]
+                break
+
+            x = contour.fit_at(y, w, h)
+            if (x is not None):
+                break
+
+            index.update(i, w - 1)
+            capped.append(i)
+            i = index.first_fit(w, i + 1)
+
+        if (i is None):
+            y = ys[-1] + shelves[ys[-1]][1] if ys else 0
+            x = 0
+            shelves[y] = [0, 0]
+            ys.append(y)
+            i = index.append(strip.width)
 
         strip.place(id, (x, y))
-        i += 1
+        if (contour is not None):
+            contour.fill((x, y), w, h)
 
-    return strip
+        shelf = shelves[y]
+        shelf[0] += w
+        if (shelf[1] == 0):
+            shelf[1] = h
+
+        index.update(i, strip.width - shelf[0])
 
 def NFDH(problem: Problem) -> Strip:
     '''Next-fit decreasing-height'''
     strip = Strip(problem, None)
-    sorted_ids = sorted(strip.unplaced, key = lambda x: strip.boxes[x].height)
+    sorted_ids = np.argsort(problem.heights, kind='stable').tolist()
 
     x = 0
     y = 0
     shelf_height = 0
     while (sorted_ids):
         id = sorted_ids.pop()
-        
-        while True:
-            while (not strip.is_valid_placement(id, (x, y))) and x < strip.width:
-                x += 1
+        box = strip.boxes[id]
 
-            if (strip.is_valid_placement(id, (x, y))):
-                break
-            
+        # every box on the shelf is at most as tall as the first one, so only
+        # the residual width matters
+        if (x + box.width > strip.width):
             y += shelf_height
             shelf_height = 0
             x = 0
@@ -53,41 +182,18 @@ def NFDH(problem: Problem) -> Strip:
         strip.place(id, (x, y))
 
         if (shelf_height == 0):
-            shelf_height = strip.boxes[id].height
+            shelf_height = box.height
         
-        x += strip.boxes[id].width
+        x += box.width
 
     return strip
 
-
 def FFDH(problem: Problem) -> Strip:
     '''First-fit decreasing-height'''
     strip = Strip(problem, None)
-    sorted_ids = sorted(strip.unplaced, key = lambda x: strip.boxes[x].height)
+    sorted_ids = np.argsort(problem.heights, kind='stable').tolist()
 
-    shelves = {0: 0}
-    while (sorted_ids):
-        id = sorted_ids.pop()
-
-        placed = False
-
-        for y in shelves:
-            x = 0
-            while (not strip.is_valid_placement(id, (x, y))) and x < strip.width:
-                x += 1
-
-            if (strip.is_valid_placement(id, (x, y))):
-                placed = True
-                strip.place(id, (x, y))
-                if (shelves[y] == 0):
-                    shelves[y] = strip.boxes[id].height
-            
-        if (placed):
-            continue
-            
-        new_shelf_height = y + shelves[y]
-        strip.place(id, (0, new_shelf_height))
-        shelves[new_shelf_height] = strip.boxes[id].height
+    first_fit_shelves(strip, sorted_ids, {0: [0, 0]})
 
     return strip
 
@@ -104,41 +210,15 @@ def SF(problem: Problem) -> Strip:
         key = lambda x: strip.boxes[x].height
     )
 
+    wide_ids = set(wide)
     narrow = sorted(
-        [id for id in strip.unplaced if id not in wide],
+        [id for id in strip.unplaced if id not in wide_ids],
         key = lambda x: strip.boxes[x].height
     )
 
     # FFDH on wide
-    # TODO: get better data structures
     shelves = {0: [0, 0]} # shelves[shelf] = [next open x pos, height of tallest box on shelf]
-    while (wide):
-        id = wide.pop()
-
-        placed = False
-
-        Y = -1
-        for y in shelves:
-            x = 0
-            Y = y
-            while (not strip.is_valid_placement(id, (x, y))) and x < strip.width:
-                x += 1
-
-            if (strip.is_valid_placement(id, (x, y))):
-                placed = True
-                strip.place(id, (x, y))
-                shelves[y][0] += strip.boxes[id].width
-                if (shelves[y][1] == 0):
-                    shelves[y][1] = strip.boxes[id].height
-            
-        if (placed):
-            continue
-            
-        new_shelf_height = Y + shelves[Y][1] if Y != -1 else 0
-        strip.place(id, (0, new_shelf_height))
-        shelves[new_shelf_height] = [0, 0]
-        shelves[new_shelf_height][0] = strip.boxes[id].width
-        shelves[new_shelf_height][1] = strip.boxes[id].height
+    first_fit_shelves(strip, wide, shelves)
 
     boxes_by_shelf = {}
     for id, pos in strip.placements.items():
@@ -184,34 +264,145 @@ def SF(problem: Problem) -> Strip:
         new_shelf_height += new_shelves[new_shelf_height][1]
 
     # FFDH on narrow
-    while (narrow):
-        id = narrow.pop()
+    contour = Contour(strip.width, track_runs=False)
+    for id, (x, y) in strip.placements.items():
+        contour.fill((x, y), strip.boxes[id].width, strip.boxes[id].height)
 
-        placed = False
+    first_fit_shelves(strip, narrow, new_shelves, contour)
 
-        Y = -1
-        for y in new_shelves:
-            x = 0
-            Y = y
-            while (not strip.is_valid_placement(id, (x, y))) and x < strip.width:
-                x += 1
-
-            if (strip.is_valid_placement(id, (x, y))):
-                placed = True
-                strip.place(id, (x, y))
-                new_shelves[y][0] += strip.boxes[id].width
-                if (new_shelves[y][1] == 0):
-                    new_shelves[y][1] = strip.boxes[id].height
-            
-        if (placed):
+    return strip
+
+class BoxIndex:
+    '''
+    Max segment tree over box sizes sorted by width, holding the priority of
+    each size with boxes left (-1 once they are all placed), so the best box
+    no wider than a gap is found in O(log n). Priorities must be distinct.
+    '''
+    def __init__(self, priorities: list[int]) -> None:
+        self.size = 1
+        while self.size < len(priorities):
+            self.size *= 2
+
+        self.tree = [-1] * (2 * self.size)
+        self.tree[self.size : self.size + len(priorities)] = priorities
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def best(self, end: int) -> int | None:
+        '''Returns the position of the highest priority among positions 0..end-1, if any box is left there'''
+        tree = self.tree
+        best = -1
+        node = None
+
+        lo = self.size
+        hi = self.size + end
+        while lo < hi:
+            if (lo & 1):
+                if (tree[lo] > best):
+                    best, node = tree[lo], lo
+                lo += 1
+            if (hi & 1):
+                hi -= 1
+                if (tree[hi] > best):
+                    best, node = tree[hi], hi
+            lo //= 2
+            hi //= 2
+
+        if (node is None):
+            return None
+
+        while node < self.size:
+            node = 2 * node if tree[2 * node] == best else 2 * node + 1
+        return node - self.size
+
+    def remove(self, i: int) -> None:
+        tree = self.tree
+        i += self.size
+        tree[i] = -1
+        i //= 2
+        while i:
+            best = max(tree[2 * i], tree[2 * i + 1])
+            if (tree[i] == best):
+                break
+            tree[i] = best
+            i //= 2
+
+def best_fit(problem: Problem, fit='width') -> Strip:
+    '''
+    Best-fit on a skyline (Burke, Kendall and Whitwell). The lowest gap of
+    the skyline, the narrowest one on ties, gets the best box that fits in
+    it, placed against the taller of the gap's neighbours: the widest box
+    (the tallest of those) or, with `fit='area'`, the largest one. When
+    nothing fits, the gap is wasted and raised to its lower neighbour.
+
+    The gaps are kept in a heap, with entries dropped once their segment is
+    gone, and the sizes of the unplaced boxes in a BoxIndex, so each step
+    takes O(log n).
+    '''
+    strip = Strip(problem, None)
+    skyline = Skyline(strip.width)
+
+    widths = strip.widths.tolist()
+    heights = strip.heights.tolist()
+
+    # boxes of the same size are interchangeable, so the index holds sizes
+    boxes = {}
+    for id in range(strip.n_boxes):
+        boxes.setdefault((widths[id], heights[id]), []).append(id)
+    sizes = sorted(boxes)
+    size_widths = [w for w, _ in sizes]
+
+    if (fit == 'area'):
+        ranked = sorted(range(len(sizes)), key = lambda i: (sizes[i][0] * sizes[i][1], i))
+    else:
+        ranked = range(len(sizes))
+
+    priorities = [0] * len(sizes)
+    for rank, i in enumerate(ranked):
+        priorities[i] = rank
+    index = BoxIndex(priorities)
+
+    gaps = [(0, strip.width, 0)]
+    n_unplaced = strip.n_boxes
+    while (n_unplaced):
+        y, width, x = heapq.heappop(gaps)
+
+        segments = skyline.segments
+        i = bisect.bisect_left(segments, x, key = lambda seg: seg[0])
+        if (i == len(segments) or segments[i] != (x, width, y)):
             continue
-        
-        
-        new_shelf_height = Y + new_shelves[Y][1] if Y != -1 else 0
-        strip.place(id, (0, new_shelf_height))
-        new_shelves[new_shelf_height] = [0, 0]
-        new_shelves[new_shelf_height][0] = strip.boxes[id].width
-        new_shelves[new_shelf_height][1] = strip.boxes[id].height
+
+        left = segments[i - 1][2] if i > 0 else None
+        right = segments[i + 1][2] if i + 1 < len(segments) else None
+
+        k = index.best(bisect.bisect_right(size_widths, width))
+        if (k is None):
+            # both neighbours are higher, or nothing would ever fit
+            top = min(h for h in (left, right) if h is not None)
+            new = skyline.fill(x, width, top)
+        else:
+            same = boxes[sizes[k]]
+            id = same.pop()
+            if (not same):
+                index.remove(k)
+            n_unplaced -= 1
+            w = widths[id]
+
+            if (right is not None and (left is None or right > left)):
+                x += width - w
+
+            strip.place(id, (x, y))
+            new = skyline.fill(x, w, y + heights[id])
+
+        for segment in new:
+            heapq.heappush(gaps, (segment[2], segment[1], segment[0]))
 
     return strip
 
+def BF(problem: Problem) -> Strip:
+    '''
+    Best-fit, by width and by area, keeping the lower packing. By width
+    alone, large boxes among many small ones are often left for last and
+    stacked on top; picking by area places them as soon as they fit.
+    '''
+    return min((best_fit(problem, fit) for fit in ('width', 'area')), key = lambda strip: strip.total_height)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import random
+import resource
+import sys
+import time
+
+from bounds import lower_bound
+from strip import Problem
+from verify import verify_strip
+import packer
+
+def run_job(conn, filename: str, method: str, params: dict, seed: int):
+    '''Runs one method on one instance in a child process and sends back its measurements'''
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    random.seed(seed)
+
+    problem = Problem.load(filename)
+
+    start = time.perf_counter()
+    strip = packer.methods[method](problem, **params)
+    wall = time.perf_counter() - start
+
+    status = 'ok' if strip is not None and len(strip.unplaced) == 0 else 'no solution'
+    if (status == 'ok'):
+        # checked after timing, so the run time is the method's alone
+        try:
+            verify_strip(strip)
+        except ValueError:
+            status = 'invalid'
+
+    conn.send({
+        'status': status,
+        'height': strip.total_height if strip is not None else None,
+        'wall_time': wall,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+def box_count(filename: str) -> int:
+    with open(filename) as fp:
+        return int(fp.readline())
+
+def run(filenames, method_names, params=None, jobs=1, timeout=60, seed=0):
+    '''
+    Runs every method on every instance, `jobs` processes at a time, and
+    returns one result dict per (instance, method). Jobs that take longer
+    than `timeout` seconds are killed and reported as timeouts.
+    '''
+    params = params or {}
+    pending = []
+    for filename in filenames:
+        problem = Problem.load(filename)
+        for method in method_names:
+            pending.append({
+                'instance': os.path.basename(filename),
+                'path': filename,
+                'n_boxes': problem.n_boxes,
+                'method': method,
+                'lower_bound': lower_bound(problem),
+            })
+    pending.reverse()
+
+    # a forked child would inherit the parent's peak RSS, which covers every
+    # instance loaded above, so start each job from a fresh interpreter
+    context = multiprocessing.get_context('spawn')
+
+    print(f'{"instance":<20} {"boxes":>6} {"meth":<5} {"status":<12} {"height":>7} {"ratio":>6} {"time (s)":>9} {"RSS (MB)":>9}')
+
+    results = []
+    running = {}
+    while pending or running:
+        while pending and len(running) < jobs:
+            job = pending.pop()
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=run_job,
+                args=(sender, job['path'], job['method'], params.get(job['method'], {}), seed),
+            )
+            process.start()
+            sender.close()
+            running[receiver] = (job, process, time.perf_counter())
+
+        multiprocessing.connection.wait(list(running), timeout=0.05)
+
+        for receiver, (job, process, start) in list(running.items()):
+            result = None
+            if (receiver.poll()):
+                result = receiver.recv()
+            elif (not process.is_alive()):
+                result = {'status': f'error (exit code {process.exitcode})'}
+            elif (time.perf_counter() - start > timeout):
+                process.kill()
+                result = {'status': 'timeout', 'wall_time': timeout}
+
+            if (result is None):
+                continue
+
+            process.join()
+            del running[receiver]
+
+            job = {k: v for k, v in job.items() if k != 'path'}
+            job.update({'status': None, 'height': None, 'wall_time': None, 'peak_rss_mb': None})
+            job.update(result)
+            job['ratio'] = job['height'] / job['lower_bound'] if job['height'] else None
+            results.append(job)
+            print_result(job)
+
+    results.sort(key=lambda r: (r['n_boxes'], r['instance'], method_names.index(r['method'])))
+    return results
+
+def print_result(result: dict):
+    fmt = lambda v, width, f='': format(format(v, f) if v is not None else '-', f'>{width}')
+    print(
+        f'{result["instance"]:<20} {result["n_boxes"]:>6} {result["method"]:<5} {result["status"]:<12}'
+        f' {fmt(result["height"], 7)} {fmt(result["ratio"], 6, ".3f")}'
+        f' {fmt(result["wall_time"], 9, ".3f")} {fmt(result["peak_rss_mb"], 9, ".1f")}',
+        flush=True,
+    )
+
+def compare(results, baseline, time_tolerance=0.25):
+    '''
+    Compares results with a baseline run and returns a list of regressions:
+    slower wall time (beyond `time_tolerance`), higher packings, or jobs
+    that used to succeed and no longer do
+    '''
+    previous = {(r['instance'], r['method']): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = previous.get((r['instance'], r['method']))
+        if (old is None or old['status'] != 'ok'):
+            continue
+
+        key = f'{r["instance"]} {r["method"]}'
+        if (r['status'] != 'ok'):
+            regressions.append(f'{key}: {r["status"]} (was ok)')
+            continue
+
+        if (r['height'] > old['height']):
+            regressions.append(f'{key}: height {old["height"]} -> {r["height"]}')
+
+        # ignore jitter on jobs that finish almost instantly
+        if (r['wall_time'] > old['wall_time'] * (1 + time_tolerance) and r['wall_time'] - old['wall_time'] > 0.05):
+            regressions.append(f'{key}: wall time {old["wall_time"]:.3f}s -> {r["wall_time"]:.3f}s')
+
+    return regressions
+
+def write_csv(results, filename: str):
+    with open(filename, 'w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='benchmark.py',
+        description='Runs packing methods over a set of instances and records time, memory and quality',
+    )
+    parser.add_argument('--instances', default='data/by_size/*', help='glob of instance files (default: data/by_size/*)')
+    parser.add_argument('--methods', default='BL,NFDH,FFDH,SF,BF', help='comma-separated methods from packer.py (default: BL,NFDH,FFDH,SF,BF)')
+    parser.add_argument('--params', default='{}', help='JSON object of keyword arguments per method, e.g. \'{"GEN": {"generations": 5}}\'')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='number of instances to run in parallel')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds before a single run is killed')
+    parser.add_argument('--max-boxes', type=int, help='skip instances with more boxes than this')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for every run, so BL and GEN are repeatable')
+    parser.add_argument('--csv', help='write results to this CSV file')
+    parser.add_argument('--json', help='write results to this JSON file (usable as a baseline)')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to check for regressions')
+    parser.add_argument('--time-tolerance', type=float, default=0.25, help='allowed relative slowdown against the baseline')
+    args = parser.parse_args()
+
+    method_names = args.methods.split(',')
+    for method in method_names:
+        if (method not in packer.methods):
+            parser.error(f'unknown method {method}; available methods: {", ".join(packer.methods)}')
+
+    if (args.jobs < 1):
+        parser.error('--jobs must be at least 1')
+
+    filenames = sorted(glob.glob(args.instances))
+    if (args.max_boxes):
+        filenames = [f for f in filenames if box_count(f) <= args.max_boxes]
+
+    results = run(filenames, method_names, json.loads(args.params), args.jobs, args.timeout, args.seed)
+
+    if (args.csv and results):
+        write_csv(results, args.csv)
+
+    if (args.json):
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+    if (args.baseline):
+        with open(args.baseline) as fp:
+            regressions = compare(results, json.load(fp), args.time_tolerance)
+
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+
+        if (regressions):
+            sys.exit(1)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import time
+
+from strip import Strip, Problem
+from approximation_algorithms import BL
+
+def linear_is_valid(strip: Strip, box_id: int, pos: tuple[int, int]) -> bool:
+    '''The original O(n) validity check, kept here for comparison'''
+    box = strip.boxes[box_id]
+    x, y = pos
+
+    if x < 0 or y < 0 or x + box.width > strip.width or y + box.height > strip.max_height:
+        return False
+
+    for b2, pos2 in strip.placements.items():
+        if (Strip.is_collision(box, pos, strip.boxes[b2], pos2)):
+            return False
+
+    return True
+
+def time_queries(check, queries) -> float:
+    start = time.perf_counter()
+    for box_id, pos in queries:
+        check(box_id, pos)
+    return (time.perf_counter() - start) / len(queries)
+
+def run(problem: Problem, n_queries=1000, seed=0):
+    random.seed(seed)
+    order = random.sample(range(problem.n_boxes), k=problem.n_boxes)
+    packed = BL(problem, order=order)
+
+    checkpoints = sorted({min(problem.n_boxes - 1, 10 ** k) for k in range(7) if 10 ** k < problem.n_boxes * 10})
+
+    print(f'{"placed":>8} {"indexed (us)":>14} {"linear (us)":>14} {"speedup":>9}')
+
+    strip = Strip(problem, None)
+    placed = 0
+    for n in checkpoints:
+        while placed < n:
+            id = order[placed]
+            strip.place(id, packed.placements[id])
+            placed += 1
+
+        unplaced = order[placed:]
+        queries = [
+            (random.choice(unplaced), (random.randrange(strip.width), random.randrange(packed.total_height)))
+            for _ in range(n_queries)
+        ]
+
+        indexed = time_queries(strip.is_valid_placement, queries)
+        linear = time_queries(lambda id, pos: linear_is_valid(strip, id, pos), queries)
+
+        print(f'{n:>8} {indexed * 1e6:>14.2f} {linear * 1e6:>14.2f} {linear / indexed:>8.1f}x')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='benchmark_index.py',
+        description='Per-query latency of Strip.is_valid_placement against the number of placed boxes',
+    )
+    parser.add_argument('filename')
+    parser.add_argument('--queries', type=int, default=1000, help='number of random queries per checkpoint')
+    args = parser.parse_args()
+
+    with open(args.filename) as fp:
+        problem = Problem(fp)
+
+    run(problem, n_queries=args.queries)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from strip import Problem
+
+def continuous_bound(width: int, widths: np.ndarray, heights: np.ndarray) -> int:
+    '''The boxes cannot take up less height than their total area over the strip width'''
+    area = int(widths.astype(np.int64) @ heights.astype(np.int64))
+    return -(-area // width)
+
+def mmv_bound(width: int, widths: np.ndarray, heights: np.ndarray) -> int:
+    '''
+    Martello, Monaci and Vigo's L1 bound. Boxes wider than half the strip
+    never sit side by side, so their heights add up. For a threshold a, boxes
+    with widths in [a, W/2] only fit next to the wide boxes of width at most
+    W - a, in the width those leave free; the area that does not fit there
+    adds height of its own. Every box width up to W/2 is tried as a.
+    '''
+    widths = widths.astype(np.int64)
+    heights = heights.astype(np.int64)
+
+    wide = 2 * widths > width
+    stacked = int(heights[wide].sum())
+    if (wide.all()):
+        return stacked
+
+    alphas = np.unique(widths[~wide])
+
+    # free area next to the wide boxes that leave at least a columns
+    order = np.argsort(widths[wide])
+    wide_widths = widths[wide][order]
+    spare = np.concatenate(([0], np.cumsum((width - wide_widths) * heights[wide][order])))
+    spare = spare[np.searchsorted(wide_widths, width - alphas, side='right')]
+
+    # area of the narrow boxes at least a wide
+    order = np.argsort(widths[~wide])
+    narrow_widths = widths[~wide][order]
+    area = np.concatenate((np.cumsum((narrow_widths * heights[~wide][order])[::-1])[::-1], [0]))
+    area = area[np.searchsorted(narrow_widths, alphas, side='left')]
+
+    extra = -(-(area - spare) // width)
+    return stacked + max(0, int(extra.max()))
+
+def lower_bound(problem: Problem) -> int:
+    '''Best of the area bound, the tallest box and the Martello-Monaci-Vigo bound'''
+    return max(
+        continuous_bound(problem.width, problem.widths, problem.heights),
+        int(problem.heights.max()),
+        mmv_bound(problem.width, problem.widths, problem.heights),
+    )
+
+def erode(cells: int, length: int) -> int:
+    '''Keeps the bits that start a run of `length` set bits'''
+    covered = 1
+    while covered < length:
+        step = min(covered, length - covered)
+        cells &= cells >> step
+        covered += step
+    return cells
+
+def dilate(cells: int, length: int) -> int:
+    '''Sets the `length` bits starting at every set bit'''
+    covered = 1
+    while covered < length:
+        step = min(covered, length - covered)
+        cells |= cells << step
+        covered += step
+    return cells
+
+def dead_area(rows: list[int], width: int, min_width: int, min_height: int) -> int:
+    '''
+    Counts the free cells of `rows` (occupancy bitmasks, as in Contour) that
+    no remaining box can cover, given the narrowest and the shortest of them:
+    cells in a horizontal free run narrower than min_width, or in a vertical
+    free run shorter than min_height. Rows past the end are free. Boxes
+    only ever fill free cells, so this area stays wasted in any completion.
+    '''
+    full = (1 << width) - 1
+    free = [~row & full for row in rows]
+
+    wide = [dilate(erode(f, min_width), min_width) for f in free]
+
+    # the same erosion and dilation over rows, one column per bit
+    tall = free + [full] * (min_height - 1)
+    covered = 1
+    while covered < min_height:
+        step = min(covered, min_height - covered)
+        tall = [a & b for a, b in zip(tall, tall[step:])]
+        covered += step
+
+    covered = 1
+    while covered < min_height:
+        step = min(covered, min_height - covered)
+        tall = [t | tall[r - step] if r >= step else t for r, t in enumerate(tall)]
+        covered += step
+
+    return sum((f & ~(w & t)).bit_count() for f, w, t in zip(free, wide, tall))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import bisect
+
+class Contour:
+    '''
+    Occupancy contour of a strip, used to find bottom-left placements without
+    scanning every (x, y) position.
+
+    Each row of the strip is stored as an integer bitmask (bit x is set when
+    column x is occupied), so holes left under overhanging boxes stay
+    reachable, exactly like the pixel-by-pixel scan in BL.
+
+    A bottom-left position always has its y on the floor or on the top edge of
+    a placed box, so only those rows are tried as candidates. The longest free
+    run of every row is cached so that candidates which cannot possibly fit are
+    skipped without building the row masks. Callers that only use fit_at can
+    turn that cache off with `track_runs`.
+    '''
+    def __init__(self, width: int, track_runs=True) -> None:
+        self.width = width
+        self.full = (1 << width) - 1
+        self.track_runs = track_runs
+
+        self.rows = []      # rows[y] = bitmask of occupied columns
+        self.runs = []      # runs[y] = longest free run in rows[y]
+        self.tops = [0]     # sorted candidate y positions
+        self.floor = 0      # every row below this one is full
+
+    def copy(self) -> 'Contour':
+        '''Shallow copy; rows are immutable ints, so this is a few list copies'''
+        cop = Contour.__new__(Contour)
+        cop.width = self.width
+        cop.full = self.full
+        cop.track_runs = self.track_runs
+        cop.rows = self.rows.copy()
+        cop.runs = self.runs.copy()
+        cop.tops = self.tops.copy()
+        cop.floor = self.floor
+        return cop
+
+    def longest_run(self, row: int) -> int:
+        free = ~row & self.full
+        if (not free):
+            return 0
+
+        # grow the run length by doubling, then refine with a binary search
+        length = 1
+        while True:
+            shifted = free & (free >> length)
+            if (not shifted):
+                break
+            free = shifted
+            length *= 2
+
+        step = length // 2
+        while step:
+            shifted = free & (free >> step)
+            if (shifted):
+                free = shifted
+                length += step
+            step //= 2
+
+        return length
+
+    def first_fit(self, row: int, width: int) -> int | None:
+        '''Returns the leftmost x where `width` free columns start in `row`'''
+        free = ~row & self.full
+        covered = 1
+        while covered < width and free:
+            step = min(covered, width - covered)
+            free &= free >> step
+            covered += step
+
+        free &= (1 << (self.width - width + 1)) - 1
+        if (not free):
+            return None
+
+        return (free & -free).bit_length() - 1
+
+    def bottom_left(self, width: int, height: int) -> tuple[int, int]:
+        '''
+        Returns the lowest, then leftmost, position where a box of the given
+        size does not overlap anything already filled
+        '''
+        while self.floor < len(self.rows) and self.rows[self.floor] == self.full:
+            self.floor += 1
+
+        n_rows = len(self.rows)
+        i = bisect.bisect_left(self.tops, self.floor)
+        while True:
+            y = self.tops[i]
+            end = min(y + height, n_rows)
+
+            r = y
+            while r < end and self.runs[r] >= width:
+                r += 1
+
+            if (r < end):
+                # row r is too crowded, so no candidate at or below it can fit
+                i = bisect.bisect_right(self.tops, r, i)
+                continue
+
+            x = self.fit_at(y, width, height)
+            if (x is not None):
+                return (x, y)
+
+            i += 1
+
+    def fit_at(self, y: int, width: int, height: int) -> int | None:
+        '''Returns the leftmost x where a box of the given size fits with its bottom edge at y'''
+        combined = 0
+        for r in range(y, min(y + height, len(self.rows))):
+            combined |= self.rows[r]
+
+        return self.first_fit(combined, width)
+
+    def fill(self, pos: tuple[int, int], width: int, height: int) -> None:
+        x, y = pos
+        top = y + height
+
+        if (top > len(self.rows)):
+            self.runs.extend([self.width] * (top - len(self.rows)))
+            self.rows.extend([0] * (top - len(self.rows)))
+
+        mask = ((1 << width) - 1) << x
+        for r in range(y, top):
+            self.rows[r] |= mask
+
+        if (self.track_runs):
+            for r in range(y, top):
+                self.runs[r] = self.longest_run(self.rows[r])
+
+        i = bisect.bisect_left(self.tops, top)
+        if (i == len(self.tops) or self.tops[i] != top):
+            self.tops.insert(i, top)
@@ -1,34 +1,265 @@
 #!/usr/bin/env python3
 
 import concurrent.futures
+import contextlib
+import hashlib
+import multiprocessing
+from multiprocessing import shared_memory
 from approximation_algorithms import BL
+from contour import Contour
+from collections import OrderedDict
+from skyline import batch_BL, skyline_BL
+from strip import Problem
+import stats
+import numpy as np
 import random
-import copy
+import queue
+import heapq
+import itertools
 import time
 
+# set in each worker process by init_worker
+worker_problem = None
+worker_memory = None
+worker_prefixes = None
+
+def order_key(order) -> bytes:
+    '''Digest of `order`, so cache keys take 16 bytes however many boxes there are'''
+    return hashlib.blake2b(np.asarray(order, dtype=np.int32), digest_size=16).digest()
+
+class FitnessCache():
+    '''Scores of previously evaluated orders, with least-recently-used eviction'''
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.scores = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, order):
+        key = order_key(order)
+        if (key in self.scores):
+            self.hits += 1
+            self.scores.move_to_end(key)
+            return self.scores[key]
+
+        self.misses += 1
+        return None
+
+    def put(self, order, score):
+        key = order_key(order)
+        self.scores[key] = score
+        self.scores.move_to_end(key)
+        if (len(self.scores) > self.maxsize):
+            self.scores.popitem(last=False)
+
+class PrefixCache():
+    '''
+    Snapshots of BL part way through an order, so an order that shares a
+    prefix with one seen before (e.g. a mutation of it) resumes from the last
+    snapshot inside the shared prefix instead of from box 0.
+
+    Snapshots are taken every `stride` boxes and keyed by a digest of the
+    prefix. Least-recently-used snapshots are evicted past `maxsize` of them
+    or past about `max_bytes` of contours, which grow with the strip height.
+    '''
+    def __init__(self, problem: Problem, maxsize=512, stride=None, max_bytes=64 << 20):
+        self.problem = problem
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.stride = stride if stride else max(1, problem.n_boxes // 16)
+        self.snapshots = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def prefix_keys(self, order):
+        '''Yields (length, key) for every snapshot-sized prefix of `order`'''
+        ids = np.asarray(order, dtype=np.int32)
+        digest = hashlib.blake2b(digest_size=16)
+        for end in range(self.stride, len(ids) + 1, self.stride):
+            digest.update(ids[end - self.stride : end])
+            yield end, digest.digest()
+
+    def contour_bytes(self, contour: Contour) -> int:
+        '''Rough size of a contour copy: its lists plus one row bitmask per row'''
+        return 8 * (len(contour.rows) + len(contour.runs) + len(contour.tops)) + len(contour.rows) * (28 + self.problem.width // 8)
+
+    def store(self, key: bytes, contour: Contour, height: int) -> None:
+        nbytes = self.contour_bytes(contour)
+        if (nbytes > self.max_bytes):
+            return
+
+        if (key in self.snapshots):
+            self.nbytes -= self.snapshots.pop(key)[2]
+        self.snapshots[key] = (contour.copy(), height, nbytes)
+        self.nbytes += nbytes
+        while len(self.snapshots) > self.maxsize or self.nbytes > self.max_bytes:
+            self.nbytes -= self.snapshots.popitem(last=False)[1][2]
+
+    def score(self, order) -> tuple[int, int]:
+        '''Returns the BL height of `order` and the number of boxes skipped'''
+        keys = dict(self.prefix_keys(order))
+
+        start, contour, height = 0, Contour(self.problem.width), 0
+        for length in sorted(keys, reverse=True):
+            snapshot = self.snapshots.get(keys[length])
+            if (snapshot is not None):
+                self.snapshots.move_to_end(keys[length])
+                start, contour, height = length, snapshot[0].copy(), snapshot[1]
+                break
+
+        if (start):
+            self.hits += 1
+        else:
+            self.misses += 1
+        stats.counters['ga_evaluations'] += 1
+        stats.counters['ga_boxes_placed'] += len(order) - start
+
+        for i in range(start, len(order)):
+            box = self.problem.boxes[order[i]]
+            pos = contour.bottom_left(box.width, box.height)
+            contour.fill(pos, box.width, box.height)
+            height = max(height, pos[1] + box.height)
+
+            if ((i + 1) in keys and i + 1 < len(order)):
+                self.store(keys[i + 1], contour, height)
+
+        return height, start
+
+def share_problem(problem: Problem) -> shared_memory.SharedMemory:
+    '''
+    Copies the box dimensions into a shared memory block laid out as
+    [width, widths..., heights...], so workers can attach to it by name
+    '''
+    n = problem.n_boxes
+    memory = shared_memory.SharedMemory(create=True, size=(2 * n + 1) * np.dtype(np.int32).itemsize)
+    data = np.ndarray((2 * n + 1,), dtype=np.int32, buffer=memory.buf)
+    data[0] = problem.width
+    data[1 : n + 1] = problem.widths
+    data[n + 1 :] = problem.heights
+    return memory
+
+def init_worker(name: str, n_boxes: int):
+    global worker_problem, worker_memory, worker_prefixes
+
+    # forked workers start with the parent's counts, which it already has
+    stats.counters.clear()
+
+    worker_memory = shared_memory.SharedMemory(name=name)
+    data = np.ndarray((2 * n_boxes + 1,), dtype=np.int32, buffer=worker_memory.buf)
+    worker_problem = Problem.from_arrays(int(data[0]), data[1 : n_boxes + 1], data[n_boxes + 1 :])
+    worker_prefixes = PrefixCache(worker_problem)
+
+def score_order(order: np.ndarray) -> tuple[int, int, dict]:
+    '''
+    Returns the BL height of `order`, how many boxes the prefix cache skipped
+    and the stats counters gathered since the last order
+    '''
+    return (*worker_prefixes.score(order.tolist()), stats.take())
+
+@contextlib.contextmanager
+def worker_pool(problem: Problem, cores: int):
+    '''Worker pool that reads the problem from shared memory, freed on exit'''
+    memory = share_problem(problem)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=cores,
+            initializer=init_worker,
+            initargs=(memory.name, problem.n_boxes),
+        ) as pool:
+            yield pool
+    finally:
+        memory.close()
+        memory.unlink()
+
+class InlinePool():
+    '''Stands in for a worker pool by running map() in the current process'''
+    def map(self, fn, iterable, chunksize=1):
+        return map(fn, iterable)
+
+def swap_mutation(order: list, n_swaps: int) -> list:
+    '''Swaps two random boxes of `order` in place, `n_swaps` times, and returns it'''
+    n = len(order)
+    if (n < 2):
+        return order
+
+    for _ in range(n_swaps):
+        i = random.randrange(n)
+        j = random.randrange(n - 1)
+        if (j >= i):
+            j += 1
+        order[i], order[j] = order[j], order[i]
+
+    return order
+
+def order_crossover(p1: list, p2: list) -> list:
+    '''
+    OX: the child keeps a random slice of `p1` where it is, and fills the
+    other positions, starting after the slice and wrapping around, with the
+    remaining boxes in the order they come in `p2` from the same point
+    '''
+    n = len(p1)
+    a, b = sorted(random.sample(range(n + 1), 2))
+    kept = set(p1[a:b])
+    rest = [id for id in p2[b:] + p2[:b] if id not in kept]
+    return rest[n - b:] + p1[a:b] + rest[:n - b]
+
+def partially_mapped_crossover(p1: list, p2: list) -> list:
+    '''
+    PMX: the child keeps a random slice of `p1` where it is, and takes every
+    other box from the same position in `p2`. A box already in the slice is
+    replaced through the slice's mapping from `p1` to `p2`, until it is not.
+    '''
+    n = len(p1)
+    a, b = sorted(random.sample(range(n + 1), 2))
+    mapping = dict(zip(p1[a:b], p2[a:b]))
+
+    child = p2.copy()
+    child[a:b] = p1[a:b]
+    for i in itertools.chain(range(a), range(b, n)):
+        id = p2[i]
+        while id in mapping:
+            id = mapping[id]
+        child[i] = id
+
+    return child
+
+crossovers = {
+    'ox'  : order_crossover,
+    'pmx' : partially_mapped_crossover,
+    'none': None,
+}
+
 class Individual():
     def __init__(self, order, score):
         self.order = order
         self.score = score
 
-    def mutate(self, N):
-        '''
-        Makes a copy of the order and swaps two boxes N times
-        '''
-        cop = copy.deepcopy(self.order)
-        for _ in range(N):
-            i1 = random.randint(0, len(cop) - 1)
-            i2 = random.randint(0, len(cop) - 1)
+    def __lt__(i1, i2):
+        return i1.score < i2.score
 
-            while i1 == i2:
-                i2 = random.randint(0, len(cop) - 1)
+def tournament(population: list, size: int) -> Individual:
+    '''The best of `size` individuals drawn at random'''
+    return min(random.sample(population, min(size, len(population))))
 
-            cop[i1], cop[i2] = cop[i2], cop[i1]
+def breed(parents: list, n_children: int, mutation_rate: int, crossover='ox', tournament_size=4) -> list:
+    '''
+    Orders for `n_children` new individuals: each is a crossover of two
+    parents picked by tournament (or a copy of one, with crossover 'none'),
+    then mutated by `mutation_rate` swaps
+    '''
+    cross = crossovers[crossover]
 
-        return cop
+    children = []
+    for _ in range(n_children):
+        p1 = tournament(parents, tournament_size)
+        if (cross is None):
+            child = p1.order.copy()
+        else:
+            child = cross(p1.order, tournament(parents, tournament_size).order)
+        children.append(swap_mutation(child, mutation_rate))
 
-    def __lt__(i1, i2):
-        return i1.score < i2.score
+    return children
 
 class Generation():
     def __init__(self, problem, size, ran=None, to_run=None):
@@ -48,41 +279,249 @@ class Generation():
     def random_order(self):
         return random.sample(list(range(self.problem.n_boxes)), k=self.problem.n_boxes)
 
-    def _run(self, cores):
-        with concurrent.futures.ProcessPoolExecutor(max_workers=cores) as executor:
-            yield from executor.map(self.run_single, self.to_run, chunksize=max(1, len(self.to_run) // cores))
+    def _run(self, orders, cores, pool=None, chunksize=None):
+        if (pool is None):
+            with worker_pool(self.problem, cores) as pool:
+                yield from self._run(orders, cores, pool, chunksize)
+            return
+
+        # only the orders and the scores cross the process boundary
+        arrays = [np.array(order, dtype=np.int32) for order in orders]
+        yield from pool.map(score_order, arrays, chunksize=chunksize or max(1, len(arrays) // cores))
+
+    def run_and_update(self, cores, batched=False, pool=None, cache=None, deadline=None):
+        '''
+        Scores every order in `to_run`. With `batched`, the whole generation is
+        packed at once on a skyline by batch_BL instead of one BL run per order.
+        `pool` is a worker pool from worker_pool to reuse; otherwise a temporary
+        one is started for this generation. Orders found in `cache` (a
+        FitnessCache) are not evaluated again, and duplicates are evaluated once.
+
+        Once `deadline` (a time.time() value) passes, no more results are
+        taken and the orders not scored yet are left out of `ran`. Orders are
+        then handed to the workers one at a time, so the workers stop within
+        one evaluation of the deadline; a batched generation runs as a whole.
+        '''
+        self.boxes_skipped = 0
+        self.boxes_total = 0
+
+        scores = {}
+        for order in self.to_run:
+            key = tuple(order)
+            if (key not in scores):
+                scores[key] = cache.get(order) if cache else None
+
+        pending = [list(key) for key, score in scores.items() if score is None]
+        if (pending):
+            if (batched):
+                results = [(score, 0, {}) for score in batch_BL(self.problem, pending).tolist()]
+                stats.counters['ga_evaluations'] += len(pending)
+            else:
+                results = self._run(pending, cores, pool, 1 if deadline else None)
+
+            for order, (score, skipped, counts) in zip(pending, results):
+                stats.merge(counts)
+                scores[tuple(order)] = score
+                self.boxes_skipped += skipped
+                self.boxes_total += len(order)
+                if (cache):
+                    cache.put(order, score)
 
-    def run_and_update(self, cores):
-        for order, score in self._run(cores):
-            self.ran.append(Individual(order, score))
+                if (not batched and deadline is not None and time.time() >= deadline):
+                    # closing the map cancels the orders the workers have not started
+                    results.close()
+                    break
 
-    def run_single(self, order):
-        return order, BL(self.problem, order=order).total_height
+        for order in self.to_run:
+            if (scores[tuple(order)] is not None):
+                self.ran.append(Individual(order, scores[tuple(order)]))
 
-def run(problem, generations=15, generation_size=40, mutation_rate=2, cores=4):
-    gen_best_height = []
+def evolve(problem, generations=15, generation_size=40, mutation_rate=2, cores=4, batched=False, cache_size=1024,
+           deadline=None, crossover='ox', tournament_size=4, steady_state=False):
+    '''
+    Runs the genetic algorithm and yields the sorted survivors of each
+    generation. Stops after `generations` generations (never, if None) or
+    once `deadline` (a time.time() value) has passed, cutting the generation
+    it passes in short (see Generation.run_and_update).
 
+    The top half survives, and children bred from it by tournament,
+    crossover and mutation fill the rest. With `steady_state`, only `cores`
+    children are bred per generation (at most half of it) and they replace
+    the worst individuals, so the population stays at `generation_size` and
+    each child breeds from the next generation on.
+    '''
     print(f'{generations=}')
     print(f'{generation_size=}')
     print(f'{mutation_rate=}')
     print(f'{cores=}')
+    print(f'{batched=}')
+    print(f'{cache_size=}')
+    print(f'{crossover=}')
+    print(f'{tournament_size=}')
+    print(f'{steady_state=}')
 
-    gen = Generation(problem, generation_size, None)
-    for g in range(generations):
-        print(f'Generation {g}:')
+    cache = FitnessCache(cache_size) if cache_size else None
 
-        start = time.time()
-        gen.run_and_update(cores)
-        runtime = time.time() - start
+    n_children = min(cores, generation_size // 2) if steady_state else generation_size - generation_size // 2
+    n_survivors = generation_size - n_children
+
+    # one pool for the whole run; the batched path doesn't need workers
+    with (contextlib.nullcontext() if batched else worker_pool(problem, cores)) as pool:
+        gen = Generation(problem, generation_size, None)
+        g = 0
+        while (generations is None or g < generations) and (deadline is None or time.time() < deadline):
+            print(f'Generation {g}:')
+
+            start = time.time()
+            gen.run_and_update(cores, batched, pool, cache, deadline)
+            runtime = time.time() - start
+
+            best = heapq.nsmallest(n_survivors, gen.ran)
 
-        best = sorted(gen.ran)[:generation_size // 2]
+            print(f'\tRuntime: {runtime:.2f} seconds')
+            print(f'\tBest:    {best[0].score}')
+            print(f'\tCutoff:  {best[-1].score}')
+            if (cache):
+                print(f'\tCache:   {cache.hits} hits, {cache.misses} misses')
+            if (not batched and gen.boxes_total):
+                # batch_BL packs every order from scratch, so only BL runs resume
+                print(f'\tResumed: {gen.boxes_skipped / gen.boxes_total:.0%} of boxes skipped by prefix snapshots')
 
-        print(f'\tRuntime: {runtime:.2f} seconds')
-        print(f'\tBest:    {best[0].score}')
-        print(f'\tCutoff:  {best[-1].score}')
+            yield best
 
-        gen = Generation(problem, generation_size, ran=best, to_run=[b.mutate(mutation_rate) for b in best])
+            children = breed(best, n_children, mutation_rate, crossover, tournament_size)
+            gen = Generation(problem, generation_size, ran=best, to_run=children)
+            g += 1
+
+def run(problem, generations=15, generation_size=40, mutation_rate=2, cores=4, batched=False, cache_size=1024,
+        crossover='ox', tournament_size=4, steady_state=False):
+    for best in evolve(problem, generations, generation_size, mutation_rate, cores, batched, cache_size,
+                       None, crossover, tournament_size, steady_state):
+        pass
+
+    if (batched):
+        return skyline_BL(problem, order=best[0].order)
 
     return BL(problem, order=best[0].order)
 
+def anytime_run(problem, deadline, generations=None, generation_size=40, mutation_rate=2, cores=4, batched=False, cache_size=1024,
+                crossover='ox', tournament_size=4, steady_state=False):
+    '''Anytime genetic algorithm: yields a Strip whenever a generation improves on the best so far'''
+    best_score = None
+    for best in evolve(problem, generations, generation_size, mutation_rate, cores, batched, cache_size,
+                       deadline, crossover, tournament_size, steady_state):
+        if (best_score is None or best[0].score < best_score):
+            best_score = best[0].score
+            yield skyline_BL(problem, order=best[0].order) if batched else BL(problem, order=best[0].order)
+
+def run_island(index, name, n_boxes, inbox, outbox, results, generations, generation_size,
+               mutation_rate, migration_interval, n_migrants, cache_size, crossover, tournament_size, steady_state):
+    '''
+    Evolves one island in its own process. Every `migration_interval`
+    generations its best `n_migrants` individuals are sent to the next island,
+    and migrants that have already arrived are picked up without waiting.
+    '''
+    random.seed()
+    init_worker(name, n_boxes)
+
+    # migrants are expendable, so don't hold up exit flushing them
+    inbox.cancel_join_thread()
+    outbox.cancel_join_thread()
+
+    pool = InlinePool()
+    cache = FitnessCache(cache_size) if cache_size else None
+
+    n_children = 1 if steady_state else generation_size - generation_size // 2
+    n_survivors = generation_size - n_children
+
+    gen = Generation(worker_problem, generation_size, None)
+    for g in range(generations):
+        start = time.time()
+        gen.run_and_update(1, False, pool, cache)
+
+        while True:
+            try:
+                order, score = inbox.get_nowait()
+            except queue.Empty:
+                break
+            gen.ran.append(Individual(order, score))
+
+        best = heapq.nsmallest(n_survivors, gen.ran)
+        print(f'Island {index}, generation {g}: best {best[0].score}, cutoff {best[-1].score}, {time.time() - start:.2f} seconds', flush=True)
+
+        if ((g + 1) % migration_interval == 0):
+            for b in best[:n_migrants]:
+                outbox.put((b.order, b.score))
+
+        children = breed(best, n_children, mutation_rate, crossover, tournament_size)
+        gen = Generation(worker_problem, generation_size, ran=best, to_run=children)
+
+    results.put((best[0].score, best[0].order, stats.take()))
+
+def run_islands(problem, generations=15, generation_size=40, mutation_rate=2, cores=4,
+                islands=None, migration_interval=5, cache_size=1024, crossover='ox', tournament_size=4, steady_state=False):
+    '''
+    Island-model genetic algorithm: `islands` independent populations (one per
+    core by default) evolve in separate processes and pass their elites around
+    a ring, so no generation waits on any other island. Each island breeds
+    like evolve, with one child per generation under `steady_state`.
+    '''
+    if (generation_size < 2):
+        raise ValueError('generation_size must be at least 2, so every island keeps a survivor')
+    if (islands is None):
+        islands = cores
+    n_migrants = max(1, generation_size // 10)
+
+    print(f'{generations=}')
+    print(f'{generation_size=}')
+    print(f'{mutation_rate=}')
+    print(f'{islands=}')
+    print(f'{migration_interval=}')
+    print(f'{cache_size=}')
+    print(f'{crossover=}')
+    print(f'{tournament_size=}')
+    print(f'{steady_state=}')
+
+    memory = share_problem(problem)
+    processes = []
+    try:
+        inboxes = [multiprocessing.Queue() for _ in range(islands)]
+        results = multiprocessing.Queue()
+
+        processes = [
+            multiprocessing.Process(target=run_island, args=(
+                i, memory.name, problem.n_boxes, inboxes[i], inboxes[(i + 1) % islands], results,
+                generations, generation_size, mutation_rate, migration_interval, n_migrants, cache_size,
+                crossover, tournament_size, steady_state,
+            ))
+            for i in range(islands)
+        ]
+        for process in processes:
+            process.start()
+
+        # an island that crashed or was killed never sends its result, so
+        # check on them between waits instead of blocking for good
+        found = []
+        while len(found) < islands:
+            try:
+                found.append(results.get(timeout=1))
+            except queue.Empty:
+                for i, process in enumerate(processes):
+                    if (process.exitcode not in (None, 0)):
+                        raise RuntimeError(f'island {i} exited with code {process.exitcode}')
+
+        for _, _, counts in found:
+            stats.merge(counts)
+        score, order, _ = min(found, key=lambda result: result[0])
+
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if (process.is_alive()):
+                process.terminate()
+                process.join()
+        memory.close()
+        memory.unlink()
 
+    return BL(problem, order=order)
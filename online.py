@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+from skyline import Skyline
+from strip import Box
+
+class BoxStream:
+    '''
+    Problem whose boxes arrive one at a time, for online packing. Iterating
+    over it yields (id, box) pairs without keeping earlier boxes around.
+    '''
+    def __init__(self, width: int, boxes, n_boxes=None) -> None:
+        self.width = width
+        self.boxes = boxes
+        self.n_boxes = n_boxes
+
+    def from_file(fp) -> 'BoxStream':
+        '''Reads the usual instance format, one line at a time, so boxes can be piped in as they are produced'''
+        n_boxes = int(fp.readline().strip())
+        width = [int(n.strip()) for n in fp.readline().split(' ')][0]
+        lines = (line for line in iter(fp.readline, '') if line.strip())
+        return BoxStream(width, map(Box.from_string, lines), n_boxes)
+
+    def __iter__(self):
+        return enumerate(self.boxes)
+
+class OnlineStrip:
+    '''
+    Strip for online packing. Placements are handed back to the caller as
+    they are made instead of being stored, so only the height and the count
+    of placed boxes are kept.
+    '''
+    def __init__(self, stream: BoxStream) -> None:
+        self.stream = stream
+        self.width = stream.width
+        self.total_height = 0
+        self.n_placed = 0
+
+    def place(self, box_id: int, pos: tuple[int, int], box: Box) -> tuple[int, tuple[int, int]]:
+        self.n_placed += 1
+        if (pos[1] + box.height > self.total_height):
+            self.total_height = pos[1] + box.height
+        return box_id, pos
+
+def next_fit(strip: OnlineStrip):
+    '''
+    Next-fit shelves: each box goes at the end of the current shelf, or
+    starts a new shelf on top when it is too wide. The current shelf is the
+    top one, so it simply grows when a taller box arrives.
+
+    Yields (id, (x, y)) for every box as soon as it is placed.
+    '''
+    x = 0
+    y = 0
+    shelf_height = 0
+    for id, box in strip.stream:
+        if (x + box.width > strip.width):
+            y += shelf_height
+            shelf_height = 0
+            x = 0
+
+        yield strip.place(id, (x, y), box)
+
+        shelf_height = max(shelf_height, box.height)
+        x += box.width
+
+def skyline_BL(strip: OnlineStrip):
+    '''
+    Bottom-up left-justified on a skyline, in arrival order. Only the
+    skyline is kept, so memory and time per box depend on the strip width
+    and not on the number of boxes already placed.
+
+    Yields (id, (x, y)) for every box as soon as it is placed.
+    '''
+    skyline = Skyline(strip.width)
+    for id, box in strip.stream:
+        x, y = skyline.bottom_left(box.width)
+        skyline.fill(x, box.width, y + box.height)
+
+        yield strip.place(id, (x, y), box)
@@ -3,94 +3,271 @@
 import argparse
 import sys
 
-from strip import Strip, Problem
+from strip import Strip, Problem, CACHE_DIR
+import anytime
 import approximation_algorithms
 import genetic
+import online
+import render
+import stats
 import tree_search
+import verify
 
 methods = {
     'BL'  : approximation_algorithms.BL,
     'NFDH': approximation_algorithms.NFDH,
     'FFDH': approximation_algorithms.FFDH,
     'SF'  : approximation_algorithms.SF,
+    'BF'  : approximation_algorithms.BF,
     'TS'  : tree_search.run_tree_search,
     'MCTS': tree_search.run_MCTS,
     'GEN' : genetic.run,
+    'ISL' : genetic.run_islands,
 }
 
+# methods that can report improving solutions under --time-limit
+anytime_methods = {
+    'TS'  : tree_search.anytime_tree_search,
+    'MCTS': tree_search.anytime_MCTS,
+    'GEN' : genetic.anytime_run,
+}
+
+# methods that place each box as it is read under --online
+online_methods = {
+    'NF'  : online.next_fit,
+    'BL'  : online.skyline_BL,
+}
+
+def positive_int(text: str) -> int:
+    value = int(text)
+    if (value < 1):
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {value}')
+    return value
+
+def non_negative_int(text: str) -> int:
+    value = int(text)
+    if (value < 0):
+        raise argparse.ArgumentTypeError(f'must be at least 0, got {value}')
+    return value
+
 parser = argparse.ArgumentParser(
     prog='packer.py',
     description='An interface for 2D strip-packing problems',
 )
 
-parser.add_argument('filename')
+parser.add_argument('filename', help='instance file, or - to read it from stdin')
 parser.add_argument(
     'method',
     help='available methods: ' + ', '.join(methods),
 )
 parser.add_argument('-p', '--print-strip', action='store_true', help='prints a visualization of the final packed strip')
+parser.add_argument('--svg', metavar='FILE', help='writes the final packed strip as an SVG image to FILE')
+parser.add_argument('--compact', action='store_true', help='stores boxes and placements in NumPy arrays to save memory on large instances')
+parser.add_argument('--no-cache', action='store_true', help='always parses the instance file instead of loading its cached binary copy')
 parser.add_argument(
     '--rounds',
     required=False,
-    type=int,
+    type=positive_int,
     help='number of rounds to perform in tree search'
 )
+parser.add_argument(
+    '--max-frontier',
+    required=False,
+    type=positive_int,
+    help='keeps at most about this many nodes in the tree search frontier, dropping the worst ones, to bound memory'
+)
 parser.add_argument(
     '--generations',
     required=False,
-    type=int,
+    type=positive_int,
     help='number of generations to run in the genetic algorithm'
 )
 parser.add_argument(
     '--generation-size',
     required=False,
-    type=int,
+    type=positive_int,
     help='size of generations in the genetic algorithm'
 )
 parser.add_argument(
     '--mutation-rate',
     required=False,
-    type=int,
+    type=positive_int,
     help='number of swaps to perform for a single mutation in the genetic algorithm'
 )
+parser.add_argument(
+    '--crossover',
+    required=False,
+    choices=genetic.crossovers,
+    help='how the genetic algorithm combines two parent orders: order crossover (default), partially mapped crossover, or none to only mutate'
+)
+parser.add_argument(
+    '--tournament-size',
+    required=False,
+    type=positive_int,
+    help='number of individuals drawn per tournament when the genetic algorithm picks parents'
+)
+parser.add_argument(
+    '--steady-state',
+    action='store_true',
+    help='replaces only the worst individuals with a few children each generation instead of breeding a whole new generation'
+)
 parser.add_argument(
     '--cores',
     required=False,
-    type=int,
-    help='number of cores to use for genetic algorithm'
+    type=positive_int,
+    help='number of cores to use for the genetic algorithm and MCTS'
+)
+parser.add_argument(
+    '--batched',
+    action='store_true',
+    help='scores each generation of the genetic algorithm in one batched skyline pass instead of a BL run per order'
+)
+parser.add_argument(
+    '--cache-size',
+    required=False,
+    type=non_negative_int,
+    help='number of scored orders the genetic algorithm remembers so repeated individuals are not re-run'
+)
+parser.add_argument(
+    '--islands',
+    required=False,
+    type=positive_int,
+    help='number of island populations for the island-model genetic algorithm (defaults to --cores)'
+)
+parser.add_argument(
+    '--migration-interval',
+    required=False,
+    type=positive_int,
+    help='generations between migrations in the island-model genetic algorithm'
+)
+parser.add_argument(
+    '--time-limit',
+    required=False,
+    type=anytime.parse_duration,
+    help='wall-clock budget such as 30s or 2m for TS, MCTS and GEN; improving solutions are printed as they are found and the best one is kept'
 )
 parser.add_argument(
     '--timeout',
     required=False,
-    type=int,
+    type=positive_int,
     help='timeout for each box placement in MCTS'
 )
+parser.add_argument(
+    '--rollout',
+    required=False,
+    choices=tree_search.rollout_policies,
+    help='how MCTS finishes a packing in each playout: random corner placements, skyline BL in a random order (default), or FFDH'
+)
+parser.add_argument(
+    '--verify',
+    action='store_true',
+    help='checks that the final packing has every box inside the strip and no overlaps, and exits with an error if not'
+)
+parser.add_argument(
+    '--stats',
+    nargs='?',
+    const='text',
+    choices=['text', 'json'],
+    help='prints the time spent loading, solving and drawing, and counts of hot-path calls (placements, collision checks, expanded nodes, playouts, GA evaluations), as text or JSON'
+)
+parser.add_argument(
+    '--online',
+    action='store_true',
+    help='packs boxes as they are read and prints each placement as "id x y" right away; methods: ' + ', '.join(online_methods)
+)
+
+def run_online(fp, method: str):
+    strip = online.OnlineStrip(online.BoxStream.from_file(fp))
+    for id, (x, y) in online_methods[method](strip):
+        print(f'{id} {x} {y}', flush=True)
+
+    print(f'Height: {strip.total_height}')
+
+def main():
+    args = parser.parse_args()
+
+    if (args.online):
+        if (args.method not in online_methods):
+            parser.error(f'--online is only supported for: {", ".join(online_methods)}')
+        if (args.print_strip):
+            parser.error('--online does not keep the strip, so it cannot be printed')
+        if (args.verify):
+            parser.error('--online does not keep the strip, so it cannot be verified')
+        if (args.svg):
+            parser.error('--online does not keep the strip, so it cannot be drawn')
+
+        with stats.timed('solve'):
+            if (args.filename in ('-', '--')):
+                run_online(sys.stdin, args.method)
+            else:
+                with open(args.filename) as fp:
+                    run_online(fp, args.method)
+
+        if (args.stats):
+            print(stats.report(args.stats))
+        return
+
+    with stats.timed('load'):
+        if (args.filename in ('-', '--')):
+            problem = Problem(sys.stdin, compact=args.compact)
+        else: 
+            problem = Problem.load(args.filename, compact=args.compact, cache_dir=None if args.no_cache else CACHE_DIR)
+
+    possible_arguments = [
+        'rounds',
+        'max_frontier',
+        'generations',
+        'generation_size',
+        'mutation_rate',
+        'crossover',
+        'tournament_size',
+        'steady_state',
+        'timeout',
+        'rollout',
+        'cores',
+        'batched',
+        'cache_size',
+        'islands',
+        'migration_interval',
+    ]
+    # store_true flags default to False; only pass them on when set, but keep
+    # explicit zeros such as --cache-size 0
+    kwargs = {k: v for k, v in vars(args).items() if v is not None and v is not False and k in possible_arguments}
+
+    if (args.time_limit and args.method not in anytime_methods):
+        parser.error(f'--time-limit is only supported for: {", ".join(anytime_methods)}')
+
+    with stats.timed('solve'):
+        if (args.time_limit):
+            soln: Strip | None = anytime.solve(anytime_methods[args.method], problem, args.time_limit, **kwargs)
+        else:
+            soln: Strip | None = methods[args.method](problem, **kwargs)
+
+    if soln is None:
+        exit(1)
 
-args = parser.parse_args()
+    assert(len(soln.unplaced) == 0)
 
-if (args.filename == '--'):
-    problem = Problem(sys.stdin)
-else: 
-    with open(args.filename) as fp:
-        problem = Problem(fp)
+    if (args.verify):
+        try:
+            with stats.timed('verify'):
+                verify.verify_strip(soln)
+        except ValueError as e:
+            print(f'Invalid packing: {e}', file=sys.stderr)
+            exit(1)
 
-possible_arguments = [
-    'rounds',
-    'generations',
-    'generation_size',
-    'mutation_rate',
-    'timeout',
-    'cores',
-]
-kwargs = {k: v for k, v in vars(args).items() if v and k in possible_arguments}
+    with stats.timed('render'):
+        if (args.print_strip):
+            soln.print()
 
-soln: Strip | None = methods[args.method](problem, **kwargs)
-assert(len(soln.unplaced) == 0)
+        if (args.svg):
+            with open(args.svg, 'w') as fp:
+                render.write_svg(soln, fp)
 
-if soln is None:
-    exit(1)
+    print(f'Height: {soln.total_height}')
 
-if (args.print_strip):
-    soln.print()
+    if (args.stats):
+        print(stats.report(args.stats))
 
-print(f'Height: {soln.total_height}')
+if __name__ == '__main__':
+    main()
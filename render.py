@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+# characters drawn at a grid point, after the first matching pattern of the
+# four cells around it (top-left, top-right, bottom-left, bottom-right)
+CHARS = np.array(['· ', '  ', '──', '│ ', '└─', '┘ ', '┌─', '┐ ', '┴─', '┬─', '├─', '┤ ', '┼─'])
+
+def placement_arrays(strip) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    '''Returns the ids, x, y, widths and heights of the placed boxes as arrays'''
+    ids = np.fromiter(strip.placements.keys(), dtype=np.int64, count=len(strip.placements))
+    pos = np.fromiter((c for p in strip.placements.values() for c in p), dtype=np.int64, count=2 * len(ids))
+    return ids, pos[0::2], pos[1::2], strip.widths[ids].astype(np.int64), strip.heights[ids].astype(np.int64)
+
+def corners(cells: np.ndarray) -> np.ndarray:
+    '''
+    Picks the character of every grid point from the ids of the cells
+    around it (-1 where free); `cells` holds one more row than the result and
+    one more column on either side
+    '''
+    tl, tr = cells[1:, :-1], cells[1:, 1:]
+    bl, br = cells[:-1, :-1], cells[:-1, 1:]
+
+    return np.select([
+        (bl == tl) & (tl == br) & (br == tr) & (bl != -1),
+        (bl == br) & (tl == tr) & (bl != tl),
+        (tr == br) & (tl == bl) & (tr != tl),
+        (bl == tl) & (tl == br) & (bl != tr),
+        (bl == br) & (br == tr) & (tr != tl),
+        (tl == tr) & (tr == bl) & (br != bl),
+        (tl == tr) & (tr == br) & (bl != br),
+        (bl == br) & (tr != tl),
+        (tl == tr) & (bl != br),
+        (bl == tl) & (br != tr),
+        (br == tr) & (bl != tl),
+        (br != tr) & (tr != tl) & (tl != bl),
+    ], range(1, 13), default=0)
+
+def text_lines(strip, band=256):
+    '''
+    Yields the strip drawn with box-drawing characters, one line per row of
+    grid points from the top of the packing down to the floor. Rows are
+    drawn `band` at a time, so memory depends on the strip width and not on
+    its height.
+    '''
+    ids, xs, ys, ws, hs = placement_arrays(strip)
+    tops = ys + hs
+
+    # grid point rows y0..y1 need the cells in rows y0 - 1 .. y1
+    y1 = strip.total_height
+    while y1 >= 0:
+        y0 = max(0, y1 - band + 1)
+
+        cells = np.full((y1 - y0 + 2, strip.width + 2), -1, dtype=np.int64)
+        for i in np.flatnonzero((ys <= y1) & (tops >= y0)).tolist():
+            low = max(ys[i], y0 - 1) - (y0 - 1)
+            high = min(tops[i], y1 + 1) - (y0 - 1)
+            cells[low:high, xs[i] + 1 : xs[i] + ws[i] + 1] = ids[i]
+
+        for row in CHARS[corners(cells)][::-1]:
+            yield ''.join(row.tolist())
+
+        y1 = y0 - 1
+
+def write_svg(strip, fp) -> None:
+    '''
+    Writes the strip as an SVG image, one rectangle per box with the floor at
+    the bottom. Rectangles are written straight from the placements, so
+    memory does not grow with the size of the strip.
+    '''
+    height = strip.total_height
+    fp.write(f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {strip.width} {height}">\n')
+    fp.write('<style>rect { stroke: #000; stroke-width: 1px; vector-effect: non-scaling-stroke }</style>\n')
+    fp.write(f'<rect x="0" y="0" width="{strip.width}" height="{height}" fill="#fff"/>\n')
+
+    for id, (x, y) in strip.placements.items():
+        w = int(strip.widths[id])
+        h = int(strip.heights[id])
+        hue = id * 137.508 % 360
+        fp.write(f'<rect x="{x}" y="{height - y - h}" width="{w}" height="{h}" fill="hsl({hue:.0f}, 60%, 75%)"><title>{id}</title></rect>\n')
+
+    fp.write('</svg>\n')
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import io
+import json
+import os
+import queue
+import random
+import signal
+import socketserver
+import sys
+import threading
+import time
+
+from strip import Problem
+import packer
+
+def init_worker():
+    # methods print progress and statistics; keep stdout free for responses
+    sys.stdout = sys.stderr
+
+def warm_up():
+    '''Runs a tiny job so the first real job doesn't pay for lazy imports and caches'''
+    problem = Problem.from_arrays(2, [1, 1], [1, 1])
+    packer.methods['BL'](problem)
+    return os.getpid()
+
+def load_problem(job: dict) -> Problem:
+    '''
+    The instance comes as `instance` (text in the usual format), `path` (an
+    instance file, loaded through the binary cache) or `width` and `boxes`
+    (a list of [width, height] pairs)
+    '''
+    if ('instance' in job):
+        return Problem(io.StringIO(job['instance']))
+
+    if ('path' in job):
+        return Problem.load(job['path'])
+
+    if ('width' in job and 'boxes' in job):
+        boxes = job['boxes']
+        return Problem.from_arrays(job['width'], [w for w, _ in boxes], [h for _, h in boxes])
+
+    raise ValueError('job needs one of "instance", "path", or "width" and "boxes"')
+
+def run_job(job: dict) -> dict:
+    '''Runs one packing job in a worker and returns its response'''
+    start = time.perf_counter()
+
+    if ('seed' in job):
+        random.seed(job['seed'])
+
+    problem = load_problem(job)
+    strip = packer.methods[job['method']](problem, **job.get('params', {}))
+
+    if (strip is None or len(strip.unplaced) != 0):
+        return {'status': 'no solution', 'time': time.perf_counter() - start}
+
+    placements = [None] * problem.n_boxes
+    for id, (x, y) in strip.placements.items():
+        placements[id] = [int(x), int(y)]
+
+    return {
+        'status': 'ok',
+        'height': int(strip.total_height),
+        'placements': placements,
+        'time': time.perf_counter() - start,
+    }
+
+class Server:
+    '''
+    Pool of warm worker processes that runs packing jobs given as JSON
+    lines. At most `queue_size` jobs are queued or running at once; reading
+    further jobs waits until one finishes. If a worker dies, the pool is
+    replaced and the jobs it took down are answered with errors.
+    '''
+    def __init__(self, workers: int, queue_size: int) -> None:
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.lock = threading.Lock()
+        self.pool = self.start_pool()
+
+    def start_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+
+        # start every worker now rather than on the first jobs
+        warm = [pool.submit(warm_up) for _ in range(self.workers)]
+        concurrent.futures.wait(warm)
+        return pool
+
+    def restart_pool(self, broken: concurrent.futures.ProcessPoolExecutor) -> None:
+        '''Replaces `broken` with a fresh pool, unless another job already has'''
+        with self.lock:
+            if (self.pool is broken):
+                broken.shutdown(wait=False, cancel_futures=True)
+                self.pool = self.start_pool()
+
+    def submit(self, line: str, respond) -> None:
+        '''
+        Schedules the job on one line; `respond` is called with the response
+        dict exactly once, possibly from another thread
+        '''
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            respond({'id': None, 'status': 'error', 'error': f'invalid JSON: {e}'})
+            return
+
+        if (not isinstance(job, dict)):
+            respond({'id': None, 'status': 'error', 'error': 'job must be a JSON object'})
+            return
+
+        if (job.get('method') not in packer.methods):
+            respond({'id': job.get('id'), 'status': 'error', 'error': f'unknown method {job.get("method")}; available methods: {", ".join(packer.methods)}'})
+            return
+
+        self.slots.acquire()
+        pool = self.pool
+        try:
+            future = pool.submit(run_job, job)
+        except RuntimeError as e:
+            # BrokenProcessPool is a RuntimeError too, as is submitting after shutdown
+            self.slots.release()
+            respond({'id': job.get('id'), 'status': 'error', 'error': f'{type(e).__name__}: {e}'})
+            if (isinstance(e, concurrent.futures.process.BrokenProcessPool)):
+                self.restart_pool(pool)
+            return
+
+        def done(future):
+            self.slots.release()
+            try:
+                response = future.result()
+            except Exception as e:
+                response = {'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+            respond({'id': job.get('id'), **response})
+
+        future.add_done_callback(done)
+
+    def serve(self, lines, write) -> None:
+        '''
+        Runs every job from an iterable of lines and writes each response as a
+        JSON line when it finishes. Lines are read on a separate thread, and
+        responses go through a queue, so a slow `write` never holds up the
+        pool's result handling.
+        '''
+        responses = queue.Queue()
+        n_jobs = None
+
+        def read():
+            n = 0
+            try:
+                for line in lines:
+                    if (line.strip()):
+                        self.submit(line, responses.put)
+                        n += 1
+            finally:
+                responses.put(n)
+
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+
+        n_written = 0
+        while n_jobs is None or n_written < n_jobs:
+            response = responses.get()
+            if (isinstance(response, int)):
+                n_jobs = response
+            else:
+                write(json.dumps(response) + '\n')
+                n_written += 1
+
+        reader.join()
+
+    def shutdown(self) -> None:
+        self.pool.shutdown()
+
+def serve_socket(server: Server, path: str):
+    '''Accepts any number of local connections, each a stream of JSON-line jobs and responses'''
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            lines = (line.decode() for line in self.rfile)
+
+            def write(text):
+                try:
+                    self.wfile.write(text.encode())
+                    self.wfile.flush()
+                except OSError:
+                    pass    # the client went away; its remaining jobs still finish
+
+            server.serve(lines, write)
+
+    if (os.path.exists(path)):
+        os.unlink(path)
+
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as listener:
+        try:
+            listener.serve_forever()
+        finally:
+            os.unlink(path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='server.py',
+        description='Serves packing jobs given as JSON lines on a pool of warm worker processes',
+    )
+    parser.add_argument('--socket', help='listen on this Unix socket instead of reading jobs from stdin')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--queue-size', type=int, help='jobs queued or running at once before reading waits (default: twice --workers)')
+    args = parser.parse_args()
+
+    # exit through the finally blocks, so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    server = Server(args.workers, args.queue_size or 2 * args.workers)
+    try:
+        if (args.socket):
+            serve_socket(server, args.socket)
+        else:
+            def write(text):
+                sys.stdout.write(text)
+                sys.stdout.flush()
+
+            server.serve(iter(sys.stdin.readline, ''), write)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
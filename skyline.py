@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+from strip import Strip, Problem
+import bisect
+import numpy as np
+import random
+
+def batch_BL(problem: Problem, orders, positions=False):
+    '''
+    Bottom-up left-justified placement on a skyline, run for a whole
+    population of orders at once.
+
+    `orders` is a 2-D array with one order per row. Every step places the
+    next box of each order at the lowest, then leftmost, spot on top of its
+    skyline, using NumPy operations across the population. Unlike BL, boxes
+    can't be tucked into holes under overhangs, so heights are usually a bit
+    worse, but one call replaces a Python BL run per order.
+
+    Returns the vector of strip heights, and the (P, n) arrays of x and y
+    positions (indexed by step, not box id) when `positions` is set.
+    '''
+    orders = np.asarray(orders)
+    P, n = orders.shape
+    W = problem.width
+
+    widths = problem.widths[orders]
+    heights = problem.heights[orders]
+
+    # sparse table of window maxima over the skyline: table[l, p, x] is the
+    # highest column in [x, x + 2**l) for order p
+    levels = max(1, int(widths.max()).bit_length())
+    pad = 1 << levels
+    blocked = np.iinfo(np.int32).max
+    table = np.full((levels, P, W + pad), blocked, dtype=np.int32)
+    table[0, :, :W] = 0
+
+    rows = np.arange(P)
+    cols = np.arange(W)
+    total_heights = np.zeros(P, dtype=np.int64)
+
+    if (positions):
+        xs = np.zeros((P, n), dtype=np.int32)
+        ys = np.zeros((P, n), dtype=np.int32)
+
+    for k in range(n):
+        w = widths[:, k]
+        h = heights[:, k]
+
+        level = np.frexp(w)[1] - 1
+        for l in range(1, int(level.max()) + 1):
+            s = 1 << (l - 1)
+            np.maximum(table[l - 1, :, :-s], table[l - 1, :, s:], out=table[l, :, :-s])
+
+        # two overlapping power-of-two windows cover [x, x + w)
+        lv = level[:, None]
+        r = rows[:, None]
+        window = np.maximum(table[lv, r, cols], table[lv, r, cols + (w - (1 << level))[:, None]])
+
+        x = window.argmin(axis=1)
+        y = window[rows, x]
+        top = y + h
+
+        covered = (cols >= x[:, None]) & (cols < (x + w)[:, None])
+        np.copyto(table[0, :, :W], top[:, None].astype(np.int32), where=covered)
+        np.maximum(total_heights, top, out=total_heights)
+
+        if (positions):
+            xs[:, k] = x
+            ys[:, k] = y
+
+    if (positions):
+        return total_heights, xs, ys
+
+    return total_heights
+
+def skyline_BL(problem: Problem, order=None) -> Strip:
+    '''Bottom-up left-justified on a skyline, for a single order'''
+    strip = Strip(problem, None)
+
+    if order is None:
+        order = random.sample(list(strip.unplaced), k = len(strip.unplaced))
+
+    _, xs, ys = batch_BL(problem, [order], positions=True)
+    for id, x, y in zip(order, xs[0].tolist(), ys[0].tolist()):
+        strip.place(id, (x, y))
+
+    return strip
+
+class Skyline:
+    '''
+    Skyline of a strip as a list of (x, width, y) segments from left to
+    right, with neighbouring segments at different heights. Its size is
+    bounded by the strip width, not by the number of boxes placed.
+    '''
+    def __init__(self, width: int) -> None:
+        self.width = width
+        self.segments = [(0, width, 0)]
+
+    def from_strip(strip: Strip) -> 'Skyline':
+        '''Skyline over the boxes already placed on a strip; holes under them are covered up'''
+        heights = np.zeros(strip.width, dtype=np.int64)
+        for id, (x, y) in strip.placements.items():
+            box = strip.boxes[id]
+            columns = heights[x : x + box.width]
+            np.maximum(columns, y + box.height, out=columns)
+
+        skyline = Skyline(strip.width)
+        starts = np.flatnonzero(np.diff(heights)) + 1
+        edges = [0] + starts.tolist() + [strip.width]
+        tops = heights[edges[:-1]].tolist()
+        skyline.segments = [(x, end - x, y) for x, end, y in zip(edges, edges[1:], tops)]
+        return skyline
+
+    def bottom_left(self, width: int) -> tuple[int, int]:
+        '''
+        Returns the lowest, then leftmost, position on top of the skyline for a
+        box of the given width. The leftmost lowest spot always starts at a
+        segment, so only segment starts are tried.
+        '''
+        segments = self.segments
+        best = None
+        for i, (x, _, y) in enumerate(segments):
+            end = x + width
+            if (end > self.width):
+                break
+
+            if (best is not None and y >= best[1]):
+                continue
+
+            j = i
+            while j < len(segments) and segments[j][0] < end:
+                y = max(y, segments[j][2])
+                if (best is not None and y >= best[1]):
+                    break
+                j += 1
+            else:
+                best = (x, y)
+
+        return best
+
+    def fill(self, x: int, width: int, top: int) -> list[tuple[int, int, int]]:
+        '''Raises the skyline to `top` over [x, x + width) and returns the segments that changed'''
+        segments = self.segments
+        end = x + width
+
+        # segments i..j-1 overlap the box
+        i = bisect.bisect_right(segments, x, key = lambda seg: seg[0]) - 1
+        j = bisect.bisect_left(segments, end, key = lambda seg: seg[0])
+
+        # the box is above everything it covers, so only the outer
+        # neighbours can be at the same height
+        first = segments[i]
+        last = segments[j - 1]
+        new = [(x, width, top)]
+        if (first[0] < x):
+            new.insert(0, (first[0], x - first[0], first[2]))
+        if (last[0] + last[1] > end):
+            new.append((end, last[0] + last[1] - end, last[2]))
+
+        if (i > 0 and segments[i - 1][2] == new[0][2]):
+            i -= 1
+            new[0] = (segments[i][0], segments[i][1] + new[0][1], new[0][2])
+        if (j < len(segments) and segments[j][2] == new[-1][2]):
+            new[-1] = (new[-1][0], new[-1][1] + segments[j][1], new[-1][2])
+            j += 1
+
+        segments[i:j] = new
+        return new
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import collections
+import contextlib
+import json
+import time
+
+# Counts of hot-path events, bumped where they happen. A Counter update
+# costs about as much as one attribute lookup, so these are always on.
+counters = collections.Counter()
+
+# seconds spent in each phase of a run
+timers = collections.Counter()
+
+@contextlib.contextmanager
+def timed(phase: str):
+    '''Adds the time spent in the block to the timer of `phase`'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timers[phase] += time.perf_counter() - start
+
+def take() -> dict:
+    '''
+    Returns the counters gathered since the last call and resets them, so a
+    worker process can send what it counted along with its results
+    '''
+    counts = dict(counters)
+    counters.clear()
+    return counts
+
+def merge(counts: dict) -> None:
+    '''Adds counters taken in another process'''
+    counters.update(counts)
+
+def report(format='text') -> str:
+    if (format == 'json'):
+        return json.dumps({'timers': dict(timers), 'counters': dict(counters)})
+
+    width = max(map(len, [*timers, *counters]), default=0) + 1
+    lines = ['Stats:']
+    lines += [f'\t{phase + ":":<{width}} {seconds:.3f} seconds' for phase, seconds in timers.items()]
+    lines += [f'\t{name + ":":<{width}} {count}' for name, count in sorted(counters.items())]
+    return '\n'.join(lines)
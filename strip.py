@@ -1,8 +1,16 @@
 #!/usr/bin/env python3
 
+import hashlib
+import io
 import numpy as np
+import os
+
+import render
+import stats
 
 class Box:
+    __slots__ = ('width', 'height', 'area')
+
     def __init__(self, width: int, height: int) -> None:
         self.width = width
         self.height = height
@@ -14,87 +22,252 @@ class Box:
     
     def __repr__(self) -> str:
         return f'Box({self.width}, {self.height})'
+
+class BoxArray:
+    '''
+    Read-only sequence of boxes backed by the problem's width/height arrays.
+    Box objects are only created when an element is accessed.
+    '''
+    def __init__(self, widths: np.ndarray, heights: np.ndarray) -> None:
+        self.widths = widths
+        self.heights = heights
+
+    def __getitem__(self, id: int) -> Box:
+        return Box(int(self.widths[id]), int(self.heights[id]))
+
+    def __len__(self) -> int:
+        return len(self.widths)
+
+    def __iter__(self):
+        for w, h in zip(self.widths.tolist(), self.heights.tolist()):
+            yield Box(w, h)
     
+# binary copies of parsed instances, keyed by a hash of the instance file
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), '2D-SPP')
+
+def parse_dims(text: str) -> np.ndarray:
+    '''
+    Parses the box lines of an instance ("id width height", followed by more
+    columns in the 2DPackLib formats) in one pass and returns an (n, 2)
+    array of widths and heights
+    '''
+    text = text.strip()
+    n_rows = text.count('\n') + 1 if text else 0
+    n_cols = len(text.split('\n', 1)[0].split())
+
+    values = np.fromstring(text, dtype=np.int64, sep=' ') if n_cols >= 3 else None
+    if (values is None or len(values) != n_rows * n_cols):
+        # ragged or blank lines; fall back to parsing them one at a time
+        values = np.array([line.split()[:3] for line in text.splitlines() if line.strip()], dtype=np.int64)
+        n_cols = 3
+
+    return values.reshape(-1, n_cols)[:, 1:3].astype(np.int32)
+
 class Problem:
-    def __init__(self, fp) -> None:
-        self.n_boxes = int(fp.readline().strip())
-        self.width = [int(n.strip()) for n in fp.readline().split(' ')][0]
-        
-        self.boxes = [Box.from_string(line) for line in fp.readlines()]
+    def __init__(self, fp, compact=False) -> None:
+        n_boxes = int(fp.readline().strip())
+        width = [int(n.strip()) for n in fp.readline().split(' ')][0]
+
+        dims = parse_dims(fp.read())
+        self.set_boxes(width, dims[:, 0], dims[:, 1], compact)
+        self.n_boxes = n_boxes
+
+    def load(filename: str, compact=False, cache_dir=CACHE_DIR) -> 'Problem':
+        '''
+        Loads an instance file through a binary cache. The first load parses
+        the text and saves the box dimensions as a .npy file named after the
+        file's hash; later loads memory-map that file instead of parsing.
+        Pass `cache_dir=None` to always parse.
+        '''
+        with open(filename, 'rb') as fp:
+            data = fp.read()
+
+        if (cache_dir is None):
+            return Problem(io.StringIO(data.decode()), compact)
+
+        # row 0 is [width, widths...], row 1 is [n_boxes, heights...]
+        path = os.path.join(cache_dir, hashlib.sha1(data).hexdigest() + '.npy')
+        try:
+            table = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            problem = Problem(io.StringIO(data.decode()), compact)
+            table = np.empty((2, len(problem.widths) + 1), dtype=np.int32)
+            table[:, 0] = (problem.width, problem.n_boxes)
+            table[0, 1:] = problem.widths
+            table[1, 1:] = problem.heights
+
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                # write under a temporary name so concurrent loads never see a partial file
+                temporary = f'{path}.{os.getpid()}.tmp'
+                with open(temporary, 'wb') as fp:
+                    np.save(fp, table)
+                os.replace(temporary, path)
+            except OSError:
+                pass
+
+            return problem
+
+        problem = Problem.from_arrays(int(table[0, 0]), table[0, 1:], table[1, 1:], compact)
+        problem.n_boxes = int(table[1, 0])
+        return problem
+
+    def from_arrays(width: int, widths: np.ndarray, heights: np.ndarray, compact=False) -> 'Problem':
+        '''Builds a problem from box dimension arrays, without copying them if they are already int32'''
+        problem = Problem.__new__(Problem)
+        problem.set_boxes(width, widths, heights, compact)
+        return problem
+
+    def set_boxes(self, width: int, widths: np.ndarray, heights: np.ndarray, compact: bool) -> None:
+        self.n_boxes = len(widths)
+        self.width = width
+        self.compact = compact
+
+        self.widths = np.ascontiguousarray(widths, dtype=np.int32)
+        self.heights = np.ascontiguousarray(heights, dtype=np.int32)
+        self.areas = self.widths * self.heights
+
+        if (compact):
+            self.boxes = BoxArray(self.widths, self.heights)
+        else:
+            self.boxes = [Box(w, h) for w, h in zip(self.widths.tolist(), self.heights.tolist())]
+
+        self.max_height = int(self.heights.sum(dtype=np.int64))
+
+        # grid cells roughly the size of an average box keep index lookups small
+        self.cell_size = (
+            max(1, int(self.widths.sum(dtype=np.int64)) // max(1, self.n_boxes)),
+            max(1, int(self.heights.sum(dtype=np.int64)) // max(1, self.n_boxes)),
+        )
+
+class GridIndex:
+    '''
+    Uniform grid over the strip that maps each cell to the boxes overlapping it,
+    so collision checks only look at nearby boxes instead of every placement.
+    '''
+    def __init__(self, cell_size: tuple[int, int]) -> None:
+        self.cell_width, self.cell_height = cell_size
+        self.cells = {}
+
+    def cells_covering(self, pos: tuple[int, int], width: int, height: int):
+        x, y = pos
+        for cx in range(x // self.cell_width, (x + width - 1) // self.cell_width + 1):
+            for cy in range(y // self.cell_height, (y + height - 1) // self.cell_height + 1):
+                yield (cx, cy)
+
+    def add(self, box_id: int, pos: tuple[int, int], box: Box) -> None:
+        for cell in self.cells_covering(pos, box.width, box.height):
+            if (cell not in self.cells):
+                self.cells[cell] = []
+            self.cells[cell].append(box_id)
+
+    def nearby(self, pos: tuple[int, int], box: Box) -> set[int]:
+        '''Returns the ids of all boxes sharing a grid cell with `box` at `pos`'''
+        found = set()
+        for cell in self.cells_covering(pos, box.width, box.height):
+            if (cell in self.cells):
+                found.update(self.cells[cell])
+        return found
 
-        self.max_height = sum(box.height for box in self.boxes)
+    def remove_last(self, box_id: int, pos: tuple[int, int], box: Box) -> None:
+        '''Removes `box_id`, which must be the most recently added box'''
+        for cell in self.cells_covering(pos, box.width, box.height):
+            self.cells[cell].pop()
+
+    def clear(self) -> None:
+        self.cells = {}
+
+    def copy(self) -> 'GridIndex':
+        cop = GridIndex((self.cell_width, self.cell_height))
+        cop.cells = {cell: ids.copy() for cell, ids in self.cells.items()}
+        return cop
 
 class Strip:
+    def __new__(cls, problem: Problem = None, init_placements=None):
+        # compact problems get array-backed strips without touching the callers
+        if (cls is Strip and problem is not None and problem.compact):
+            cls = CompactStrip
+        return super().__new__(cls)
+
     def __init__(self, problem: Problem, init_placements: None) -> None:
         self.total_height = 0
 
         self.placements = {}
-        self.unplaced = [id for id in range(problem.n_boxes)]
+        self.unplaced = dict.fromkeys(range(problem.n_boxes))
 
         self.n_boxes = problem.n_boxes 
         self.width = problem.width 
         self.boxes = problem.boxes 
         self.max_height = problem.max_height 
+        self.cell_size = problem.cell_size
+        self.compact = problem.compact
+        self.widths = problem.widths
+        self.heights = problem.heights
+
+        self.grid = None
+        self.row_masks = None
+        self.height_log = []
 
         if (init_placements):
             for id, (x, y) in init_placements.items():
                 self.place(id, (x, y))
 
+    @property
+    def rows(self) -> list[int]:
+        '''
+        Occupancy of every row as a bitmask (bit x is set when column x is
+        covered, as in Contour). Built on first use and then kept up to date
+        by place and undo; it may run past total_height with empty rows.
+        '''
+        if (self.row_masks is None):
+            self.row_masks = []
+            for id, pos in self.placements.items():
+                self.fill_rows(id, pos)
+        return self.row_masks
+
+    def fill_rows(self, box_id: int, pos: tuple[int, int]) -> None:
+        x, y = pos
+        box = self.boxes[box_id]
+        if (y + box.height > len(self.row_masks)):
+            self.row_masks.extend([0] * (y + box.height - len(self.row_masks)))
+
+        mask = ((1 << box.width) - 1) << x
+        for r in range(y, y + box.height):
+            self.row_masks[r] |= mask
+
+    def clear_rows(self, box_id: int, pos: tuple[int, int]) -> None:
+        x, y = pos
+        box = self.boxes[box_id]
+        mask = ~(((1 << box.width) - 1) << x)
+        for r in range(y, y + box.height):
+            self.row_masks[r] &= mask
+
+    @property
+    def index(self) -> GridIndex:
+        '''
+        Built on the first collision query, so strips that are only ever
+        placed into (BL, the shelf algorithms) never pay for it
+        '''
+        if (self.grid is None):
+            self.grid = GridIndex(self.cell_size)
+            for id, pos in self.placements.items():
+                self.grid.add(id, pos, self.boxes[id])
+        return self.grid
+
     def clear_placements(self):
         self.placements = {}
-        self.unplaced = [id for id in range(self.n_boxes)]
+        self.unplaced = dict.fromkeys(range(self.n_boxes))
+        self.grid = None
+        self.row_masks = None
+        self.height_log = []
 
     def print(self) -> None:
-        grid = np.full((self.width, self.max_height), None)
-
-        for id, (x, y) in self.placements.items():
-            w = self.boxes[id].width
-            h = self.boxes[id].height
-
-            grid[x : x + w, y : y + h] = id
-
-        for r in map(lambda j: grid.shape[1] - j - 1, range(1, grid.shape[1] - 1)):
-            for c in range(1, grid.shape[0] + 1):
-                in_bounds = lambda c, r: c > 0 and c < grid.shape[0] and r > 0 and r < grid.shape[1]
-
-                tl = grid[c-1, r  ] if in_bounds(c-1, r  ) else None
-                tr = grid[c,   r  ] if in_bounds(c,   r  ) else None
-                bl = grid[c-1, r-1] if in_bounds(c-1, r-1) else None
-                br = grid[c,   r-1] if in_bounds(c,   r-1) else None
-
-                #   ┌ ├ ┐ ┼  ├
-
-                char = '· '
-
-                if bl == tl == br == tr and bl is not None:
-                    char = '  '
-                elif bl == br and tl == tr and bl != tl:
-                    char = '──' 
-                elif tr == br and tl == bl and tr != tl:
-                    char = '│ '
-                elif bl == tl == br and bl != tr:
-                    char = '└─'
-                elif bl == br == tr and tr != tl:
-                    char = '┘ '
-                elif tl == tr == bl and br != bl:
-                    char = '┌─' 
-                elif tl == tr == br and bl != br:
-                    char = '┐ '
-                elif bl == br and tr != tl:
-                    char = '┴─'
-                elif tl == tr and bl != br:
-                    char = '┬─'
-                elif bl == tl and br != tr:
-                    char = '├─'
-                elif br == tr and bl != tl:
-                    char = '┤ '
-                elif br != tr != tl != bl:
-                    char = '┼─'
-
-                print(char, end='')
-            print()
+        '''Draws the packing with box-drawing characters, from its top down to the floor'''
+        for line in render.text_lines(self):
+            print(line)
 
     def is_collision(b1: Box, pos1: tuple[int, int], b2: Box, pos2: tuple[int, int]):
+        stats.counters['is_collision'] += 1
         x1, y1 = pos1
         x2, y2 = pos2
         return x1 + b1.width > x2 and y1 + b1.height > y2 \
@@ -102,6 +275,7 @@ class Strip:
                                   and y1 < y2 + b2.height
             
     def is_valid_placement(self, box_id: int, pos: tuple[int, int]) -> bool:
+        stats.counters['is_valid_placement'] += 1
         if box_id in self.placements:
             return False
         
@@ -117,27 +291,41 @@ class Strip:
         if y + box.height > self.max_height:
             return False
         
-        for b2, pos2 in self.placements.items():
-            if (Strip.is_collision(box, pos, self.boxes[b2], pos2)):
+        for b2 in self.index.nearby(pos, box):
+            if (Strip.is_collision(box, pos, self.boxes[b2], self.placements[b2])):
                 return False
         
         return True
 
     def place(self, box_id: int, pos: tuple[int, int]):
-        # These are sanity checks... only remove when you're SURE your algorithm works
-        # if (box_id in self.placements):
-            # raise RuntimeError(f'Box(id={box_id}) already placed')
-        # 
-        # is_valid = self.is_valid_placement(box_id, pos)
-        # if (not is_valid):
-            # raise RuntimeError('invalid placement')
-        
-        self.unplaced.remove(box_id)        
+        # not checked here, as that makes packing quadratic; verify.py checks whole packings
+        stats.counters['place'] += 1
+        del self.unplaced[box_id]
         self.placements[box_id] = pos
+        if (self.grid is not None):
+            self.grid.add(box_id, pos, self.boxes[box_id])
+        if (self.row_masks is not None):
+            self.fill_rows(box_id, pos)
+        self.height_log.append(self.total_height)
 
         new_height = pos[1] + self.boxes[box_id].height
         if (new_height > self.total_height):
             self.total_height = new_height
+
+    def undo(self) -> tuple[int, tuple[int, int]]:
+        '''
+        Removes the most recent placement and returns it as (box_id, pos).
+        The id goes back to the end of `unplaced`, so iteration order over
+        unplaced boxes is only preserved up to sorting.
+        '''
+        box_id, pos = self.placements.popitem()
+        self.unplaced[box_id] = None
+        if (self.grid is not None):
+            self.grid.remove_last(box_id, pos, self.boxes[box_id])
+        if (self.row_masks is not None):
+            self.clear_rows(box_id, pos)
+        self.total_height = self.height_log.pop()
+        return box_id, pos
     
     def total_area(self):
         return sum(self.boxes[id].area for id in self.placements)
@@ -145,3 +333,131 @@ class Strip:
     def __lt__(s1, s2):
         return False
 
+
+class PlacementView:
+    '''Read-only dict-like view of a CompactStrip's placements, in placement order'''
+    def __init__(self, strip: 'CompactStrip') -> None:
+        self.strip = strip
+
+    def __getitem__(self, id: int) -> tuple[int, int]:
+        if (not self.strip.placed[id]):
+            raise KeyError(id)
+        return (int(self.strip.xs[id]), int(self.strip.ys[id]))
+
+    def __contains__(self, id: int) -> bool:
+        return bool(self.strip.placed[id])
+
+    def __len__(self) -> int:
+        return self.strip.n_placed
+
+    def __iter__(self):
+        yield from self.strip.order[:self.strip.n_placed].tolist()
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for _, pos in self.items():
+            yield pos
+
+    def items(self):
+        ids = self.strip.order[:self.strip.n_placed]
+        yield from zip(ids.tolist(), zip(self.strip.xs[ids].tolist(), self.strip.ys[ids].tolist()))
+
+    def __eq__(self, other) -> bool:
+        return dict(self.items()) == dict(other.items())
+
+class UnplacedView:
+    '''Read-only set-like view of the ids a CompactStrip has not placed, in id order'''
+    def __init__(self, strip: 'CompactStrip') -> None:
+        self.strip = strip
+
+    def __contains__(self, id: int) -> bool:
+        return not self.strip.placed[id]
+
+    def __len__(self) -> int:
+        return self.strip.n_boxes - self.strip.n_placed
+
+    def __iter__(self):
+        yield from np.flatnonzero(~self.strip.placed).tolist()
+
+class CompactStrip(Strip):
+    '''
+    Strip whose placements live in int32 x/y arrays plus a placed mask, so that
+    a large strip takes a few bytes per box. `placements` and `unplaced` are
+    views that behave like the dict-based ones in Strip.
+    '''
+    def __init__(self, problem: Problem, init_placements=None) -> None:
+        self.n_boxes = problem.n_boxes
+        self.width = problem.width
+        self.boxes = problem.boxes
+        self.max_height = problem.max_height
+        self.cell_size = problem.cell_size
+        self.compact = True
+        self.widths = problem.widths
+        self.heights = problem.heights
+
+        self.total_height = 0
+        self.xs = np.zeros(self.n_boxes, dtype=np.int32)
+        self.ys = np.zeros(self.n_boxes, dtype=np.int32)
+        self.placed = np.zeros(self.n_boxes, dtype=bool)
+        self.order = np.zeros(self.n_boxes, dtype=np.int32)
+        self.n_placed = 0
+        self.grid = None
+        self.row_masks = None
+        self.height_log = []
+
+        if (init_placements):
+            for id, (x, y) in init_placements.items():
+                self.place(id, (x, y))
+
+    @property
+    def placements(self) -> PlacementView:
+        return PlacementView(self)
+
+    @property
+    def unplaced(self) -> UnplacedView:
+        return UnplacedView(self)
+
+    def clear_placements(self):
+        self.placed[:] = False
+        self.n_placed = 0
+        self.grid = None
+        self.row_masks = None
+        self.height_log = []
+
+    def place(self, box_id: int, pos: tuple[int, int]):
+        stats.counters['place'] += 1
+        x, y = pos
+        self.xs[box_id] = x
+        self.ys[box_id] = y
+        self.placed[box_id] = True
+        self.order[self.n_placed] = box_id
+        self.n_placed += 1
+
+        box = self.boxes[box_id]
+        if (self.grid is not None):
+            self.grid.add(box_id, pos, box)
+        if (self.row_masks is not None):
+            self.fill_rows(box_id, pos)
+        self.height_log.append(self.total_height)
+
+        if (y + box.height > self.total_height):
+            self.total_height = y + box.height
+
+    def undo(self) -> tuple[int, tuple[int, int]]:
+        self.n_placed -= 1
+        box_id = int(self.order[self.n_placed])
+        pos = (int(self.xs[box_id]), int(self.ys[box_id]))
+
+        self.placed[box_id] = False
+        if (self.grid is not None):
+            self.grid.remove_last(box_id, pos, self.boxes[box_id])
+        if (self.row_masks is not None):
+            self.clear_rows(box_id, pos)
+        self.total_height = self.height_log.pop()
+        return box_id, pos
+
+    def total_area(self):
+        ids = self.order[:self.n_placed]
+        return int(self.widths[ids].astype(np.int64) @ self.heights[ids])
@@ -1,27 +1,251 @@
 #!/usr/bin/env python3
 
 from strip import Strip, Problem
-import itertools
+from approximation_algorithms import BL, FFDH, first_fit_shelves
+from skyline import Skyline
+import bounds
+import stats
+import multiprocessing
+import numpy as np
 import tqdm
 import heapq
 import math
 import random
 import datetime
+import time
 import sys
 import functools
+import weakref
+
+def any_within(cells: int, length: int) -> int:
+    '''Sets bit x wherever any of the bits x to x + length - 1 is set'''
+    covered = 1
+    while covered < length:
+        step = min(covered, length - covered)
+        cells |= cells >> step
+        covered += step
+    return cells
+
+def smart_prospectives(strip: Strip, box_id: int, after=None, left_support=True):
+    '''
+    Yields every position (x, y) where the box fits and rests on the floor or
+    on a placed box, so it cannot drop down; with `left_support`, only those
+    where it also touches the left wall or a placed box, so it cannot slide
+    left either. With `after`, an (x, y) position, only positions after it
+    in (y, x) order are given.
+
+    Candidate rows are the floor and the top edges of the placed boxes; each
+    one is checked for every x at once with a few bit operations on the
+    strip's row masks, which place and undo keep up to date.
+    '''
+    if (box_id in strip.placements):
+        raise RuntimeError
+
+    box = strip.boxes[box_id]
+    rows = strip.rows
+    full = (1 << strip.width) - 1
+    in_strip = (1 << (strip.width - box.width + 1)) - 1
+
+    tops = {0}
+    for id, (_, y) in strip.placements.items():
+        tops.add(y + strip.boxes[id].height)
+
+    for y in sorted(tops):
+        if (after is not None and y < after[1]):
+            continue
+
+        combined = 0
+        for r in range(y, min(y + box.height, len(rows))):
+            combined |= rows[r]
+
+        xs = bounds.erode(~combined & full, box.width) & in_strip
+        if (y > 0):
+            xs &= any_within(rows[y - 1], box.width)
+        if (left_support):
+            xs &= (combined << 1) | 1
+        if (after is not None and y == after[1]):
+            xs &= -1 << (after[0] + 1)
+
+        while xs:
+            low = xs & -xs
+            yield (low.bit_length() - 1, y)
+            xs ^= low
+
+def distinct_unplaced(strip: Strip):
+    '''
+    Yields the first unplaced id of every box size; boxes of the same size
+    are interchangeable, so placing the others is never tried
+    '''
+    # undo() re-appends ids to `unplaced`, so sort to keep a stable order
+    sizes = set()
+    for id in sorted(strip.unplaced):
+        box = strip.boxes[id]
+        if ((box.width, box.height) not in sizes):
+            sizes.add((box.width, box.height))
+            yield id
+
+def possible_placements(strip: Strip):
+    for id in distinct_unplaced(strip):
+        for pos in smart_prospectives(strip, id):
+            yield (id, pos)
+
+def random_rollout(strip: Strip):
+    '''Places the remaining boxes one at a time at a random valid corner position'''
+    while (strip.unplaced):
+        id, pos = random.choice(list(possible_placements(strip)))
+        strip.place(id, pos)
+
+def skyline_rollout(strip: Strip):
+    '''Places the remaining boxes in a random order, bottom-left on the skyline of the placed ones'''
+    skyline = Skyline.from_strip(strip)
+    for id in random.sample(list(strip.unplaced), k=len(strip.unplaced)):
+        box = strip.boxes[id]
+        x, y = skyline.bottom_left(box.width)
+        skyline.fill(x, box.width, y + box.height)
+        strip.place(id, (x, y))
+
+def ffdh_rollout(strip: Strip):
+    '''Packs the remaining boxes with FFDH on shelves above the placed ones'''
+    ids = sorted(strip.unplaced, key=lambda id: strip.boxes[id].height)
+    first_fit_shelves(strip, ids, {strip.total_height: [0, 0]})
+
+rollout_policies = {
+    'random' : random_rollout,
+    'skyline': skyline_rollout,
+    'ffdh'   : ffdh_rollout,
+}
+
+class Zobrist():
+    '''
+    Random 64-bit codes for (box_id, (x, y)) placements, drawn on first use.
+    XORing the codes of a set of placements hashes the set regardless of the
+    order the placements were made in, and placing a box updates the hash in
+    O(1).
+    '''
+    def __init__(self) -> None:
+        self.codes = {}
+        # a private generator, so hashing doesn't change the random sequence of the searches
+        self.rng = random.Random(0)
+
+    def __call__(self, placement: tuple[int, tuple[int, int]]) -> int:
+        code = self.codes.get(placement)
+        if (code is None):
+            code = self.codes[placement] = self.rng.getrandbits(64)
+        return code
+
+class StripCursor():
+    '''
+    A single working Strip shared by every node of a tree. The strip is moved
+    to a node's state by undoing placements up to the common ancestor and
+    replaying the rest of the path, so nodes never hold a Strip of their own.
+    '''
+    def __init__(self, strip: Strip, node: 'TreeNode') -> None:
+        self.strip = strip
+        self.node = node
+
+    def checkout(self, target: 'TreeNode') -> Strip:
+        if (target is self.node):
+            return self.strip
+
+        current = self.node
+        node = target
+        path = []
+
+        while node.depth > current.depth:
+            path.append(node)
+            node = node.parent
+
+        while current.depth > node.depth:
+            self.strip.undo()
+            current = current.parent
+
+        while current is not node:
+            self.strip.undo()
+            current = current.parent
+            path.append(node)
+            node = node.parent
+
+        for step in reversed(path):
+            self.strip.place(*step.placement)
+
+        self.node = target
+        return self.strip
 
 class TreeNode():
-    def __init__(self, parent: "TreeNode", problem: Problem, placements: dict) -> None:
+    def __init__(self, parent: "TreeNode", problem: Problem, placement: tuple[int, tuple[int, int]] | None) -> None:
+        '''
+        Creates the root node of a tree (no parent) or the child reached by
+        `placement`, given as (box_id, (x, y)). A child only records its own
+        placement and a few running totals, so creating one is O(1).
+        '''
         self.parent = parent
-        self.strip = Strip(problem, placements)
+        self.placement = placement
+
+        if (parent is None):
+            self.cursor = StripCursor(Strip(problem, None), self)
+            self.zobrist = Zobrist()
+            self.key = 0
+            self.depth = 0
+            self.total_height = 0
+            self.unplaced_height = sum(box.height for box in self.cursor.strip.boxes)
+        else:
+            box_id, (_, y) = placement
+            height = parent.cursor.strip.boxes[box_id].height
+
+            self.cursor = parent.cursor
+            self.zobrist = parent.zobrist
+            self.key = parent.key ^ self.zobrist(placement)
+            self.depth = parent.depth + 1
+            self.total_height = max(parent.total_height, y + height)
+            self.unplaced_height = parent.unplaced_height - height
+
+        self.n_unplaced = self.cursor.strip.n_boxes - self.depth
 
         self.children = None
 
+        # used for tree search; once computed, a lower bound on the height
+        # of any packing completed from this node, the area it already
+        # wastes, and the first free cell after its placement
+        self.bound = None
+        self.dead = 0
+        self.gap = None
+        self.tracker = None
+
         # used for MCTS
         self.child_generator = None
         self.wins = 0
         self.playouts = 0
 
+    @property
+    def strip(self) -> Strip:
+        '''
+        The tree's shared Strip, moved to this node's state. It is only valid
+        until another node of the same tree is checked out; use to_strip() for
+        a copy that outlives that.
+        '''
+        return self.cursor.checkout(self)
+
+    def placements(self) -> dict:
+        path = []
+        node = self
+        while node.parent:
+            path.append(node.placement)
+            node = node.parent
+        return dict(reversed(path))
+
+    def to_strip(self) -> Strip:
+        return Strip(self.cursor.strip, self.placements())
+
+    def placement_from(self, parent: 'TreeNode') -> tuple[int, tuple[int, int]]:
+        '''Returns the placement that leads from `parent` to this node, which for a shared node need not be its own'''
+        if (self.parent is parent):
+            return self.placement
+
+        placed = parent.placements()
+        for id, pos in self.placements().items():
+            if (id not in placed):
+                return (id, pos)
+
     def smart_prospectives(self, box_id: int):
         '''
         Makes some assumptions about prospective placements to
@@ -29,162 +253,593 @@ class TreeNode():
         
         Assumptions:
         - First box is placed in the bottom left corner
-        - Boxes are best placed when touching another box (corners inclusive)
+        - Boxes are best placed where they can neither drop down nor slide
+          left, since any packing can be pushed into such a shape without
+          getting taller
 
         Returns a generator of (x, y) tuples
         '''
-        if (box_id in self.strip.placements):
-            raise RuntimeError
-
-        if (len(self.strip.placements) == 0):
-            yield (0,0)
-        else:
-            test_box = self.strip.boxes[box_id]
-            for id, (x, y) in self.strip.placements.items():
-                box = self.strip.boxes[id]
-
-                left_edge = x - test_box.width
-                right_edge = x + box.width
-                bottom_edge = y - test_box.height
-                top_edge = y + box.height
-
-                locs = set(itertools.chain(
-                    ((right_edge, t) for t in range(bottom_edge, top_edge + 1)),
-                    ((left_edge, t) for t in range(bottom_edge, top_edge + 1)),
-                    ((t, bottom_edge) for t in range(left_edge, right_edge + 1)),
-                    ((t, top_edge) for t in range(left_edge, right_edge + 1)),
-                ))
-
-                for loc in locs:
-                    if (self.strip.is_valid_placement(box_id, loc)):
-                        yield loc
+        return smart_prospectives(self.strip, box_id)
 
     def possible_placements(self):
-        for id in self.strip.unplaced:
-            for pos in self.smart_prospectives(id):
-                yield (id, pos)
+        return possible_placements(self.strip)
     
     def remaining_height(self):
-        return sum(self.strip.boxes[id].height for id in self.strip.unplaced)
+        return self.unplaced_height
       
-    def expand(self):        
+    def expand(self, table: dict | None = None, placements=None):
+        '''
+        Yields a child for every possible placement, or every one of
+        `placements` if given. Children from a later call are added to those
+        of earlier ones.
+
+        With a transposition table (Zobrist key -> node), a placement that
+        leads to a set of placements already in the table yields that node
+        instead of a new one, so the children of different nodes may be
+        shared; new children are added to the table.
+        '''
         if (self.children is None):
             self.children = []
-        else:
-            raise RuntimeError
 
-        for id, pos in self.possible_placements():
-            child_node = TreeNode(self, self.strip, self.strip.placements)
-            child_node.strip.place(id, pos)
+        if (placements is None):
+            placements = self.possible_placements()
+
+        # the shared strip moves while children are handed out, so the
+        # candidates have to be collected up front
+        for placement in list(placements):
+            child_node = None
+            if (table is not None):
+                child_node = table.get(self.key ^ self.zobrist(placement))
+
+            if (child_node is None):
+                child_node = TreeNode(self, None, placement)
+                if (table is not None):
+                    table[child_node.key] = child_node
+
             self.children.append(child_node)
+            stats.counters['expanded_children'] += 1
             yield child_node
 
     def __lt__(n1: 'TreeNode', n2: 'TreeNode'):
         return False
     
 class Tree():
-    def __init__(self, problem: Problem) -> None:
+    '''
+    Best-first branch and bound. Nodes are visited in order of a lower bound
+    on the height of any packing completed from them, ties broken by the
+    old estimate (height so far plus the heights of the unplaced boxes) so
+    the search still dives towards complete packings. FFDH and BL provide
+    the first incumbent, and nodes whose bound reaches it are pruned.
+
+    Any packing can be pushed down and left until no box can move, without
+    getting taller, and then built box by box in order of (y, x) with every
+    box resting on the floor or on a box placed before it. Only those
+    placements are tried, so each packing is built in one order only, and
+    free space behind the last placement can never be filled again. (A box
+    may touch its left neighbour only once that is placed later, so
+    positions that cannot slide left are not required here.)
+
+    Only the frontier and the ancestors of its nodes are kept in memory.
+    With `max_frontier`, the frontier is cut back to its best
+    `max_frontier` nodes whenever it grows to twice that, so memory stays
+    bounded; the lowest bound among dropped nodes is remembered, so the
+    search never claims optimality it did not prove.
+    '''
+    def __init__(self, problem: Problem, max_frontier: int | None = None) -> None:
         self.root = TreeNode(None, problem, None)
+        self.width = problem.width
+        self.area = int(problem.areas.sum(dtype=np.int64))
+        self.lower_bound = bounds.lower_bound(problem)
+
+        by_height = np.argsort(-problem.heights, kind='stable').tolist()
+        self.incumbent = min(FFDH(problem), BL(problem, by_height), key=lambda strip: strip.total_height)
+
+        self.frontier = [(self.lower_bound, self.root.total_height + self.root.remaining_height(), self.root)]
+        self.max_frontier = max_frontier
+        self.dropped = math.inf     # lowest bound among nodes dropped from the frontier
+
+        # nodes still in memory, i.e. the frontier and the ancestors of its
+        # nodes; each node counts itself out through a weak reference once it
+        # is freed. Placements go in (y, x) order, so a set of placements is
+        # only ever reached one way and no transposition table is needed.
+        self.n_live = 1
+        self.n_nodes = 1
+        self.peak_nodes = 1
+        self.n_pruned = 0
+        self.n_dropped = 0
+
+    def bound(self, node: TreeNode) -> tuple[int, int, tuple[int, int]]:
+        '''
+        Lower bound for `node`: the instance's lower bound, the height so far,
+        and the area of all boxes plus the free area below the current height
+        that none of the unplaced boxes can reach, over the strip width.
+
+        Returns the bound, that wasted area, and the first free (x, y) after
+        the last placement in (y, x) order
+        '''
+        strip = node.strip
+        if (node.n_unplaced == 0):
+            return strip.total_height, 0, (0, strip.total_height)
+
+        rows = strip.rows[:strip.total_height]
+
+        # boxes still to come start at or after the last placement, so free
+        # cells before it are wasted
+        full = (1 << self.width) - 1
+        dead = 0
+        if (node.placement is not None):
+            _, (x, y) = node.placement
+            dead = sum((~row & full).bit_count() for row in rows[:y])
+            rows = rows[y:]
+            if (rows):
+                dead += (~rows[0] & ((1 << x) - 1)).bit_count()
+                rows[0] |= (1 << x) - 1
+
+        gap = (0, strip.total_height)
+        for r, row in enumerate(rows):
+            free = ~row & full
+            if (free):
+                gap = ((free & -free).bit_length() - 1, strip.total_height - len(rows) + r)
+                break
+
+        unplaced = list(strip.unplaced)
+        dead += bounds.dead_area(rows, self.width, int(strip.widths[unplaced].min()), int(strip.heights[unplaced].min()))
+        return max(self.lower_bound, node.total_height, -(-(self.area + dead) // self.width)), dead, gap
+
+    def placements(self, node: TreeNode) -> list[tuple[int, tuple[int, int]]]:
+        '''Placements after the node's own in (y, x) order, with the box resting on the floor or a placed box'''
+        strip = node.strip
+        after = node.placement[1] if node.placement is not None else None
+        return [
+            (id, pos)
+            for id in distinct_unplaced(strip)
+            for pos in smart_prospectives(strip, id, after, left_support=False)
+        ]
 
-        self.visited = []
-        self.complete = []
-        self.frontier = [((self.root.strip.total_height + self.root.remaining_height()), self.root)]
+    def best_bound(self) -> int:
+        '''Lowest bound of any node that could still beat the incumbent, counting dropped ones'''
+        frontier = self.frontier[0][0] if self.frontier else math.inf
+        return max(self.lower_bound, min(frontier, self.dropped))
+
+    def is_optimal(self) -> bool:
+        '''True once no node left, or dropped, can beat the incumbent'''
+        return self.incumbent.total_height <= self.best_bound()
+
+    def is_done(self) -> bool:
+        return not self.frontier or self.is_optimal()
 
     def visit_best(self):
-        score, node = heapq.heappop(self.frontier)
+        bound, score, node = heapq.heappop(self.frontier)
+
+        if (bound >= self.incumbent.total_height):
+            self.n_pruned += 1
+            return
+
+        if (node.bound is None):
+            # children are queued with a quick bound from their parent;
+            # compute their own when they come up, and requeue them if it
+            # is higher
+            node.bound, node.dead, node.gap = self.bound(node)
+            if (node.bound > bound):
+                heapq.heappush(self.frontier, (node.bound, score, node))
+                return
+
+        # a child that does not fill the first free cell leaves it empty for
+        # good, so those children come after the ones that fill it, with a
+        # bound that counts the cell as wasted
+        skipped_bound = max(node.bound, -(-(self.area + node.dead + 1) // self.width))
+
+        if (node.children is not None):
+            # second visit: the children that skip the first free cell
+            skipping = [placement for placement in self.placements(node) if placement[1] != node.gap]
+            self.push_children(node, node.expand(placements=skipping), skipped_bound)
+            self.trim()
+            return
+
+        if (node.n_unplaced == 0):
+            self.incumbent = node.to_strip()
+            return
+
+        # positions come in (y, x) order, so starting just before the gap
+        # the first one is the gap itself if the box can go there
+        strip = node.strip
+        gap_x, gap_y = node.gap
+        at_gap = [
+            (id, node.gap)
+            for id in distinct_unplaced(strip)
+            if next(smart_prospectives(strip, id, (gap_x - 1, gap_y), left_support=False), None) == node.gap
+        ]
+        self.push_children(node, node.expand(placements=at_gap), node.bound)
+
+        if (skipped_bound < self.incumbent.total_height):
+            heapq.heappush(self.frontier, (skipped_bound, score, node))
+        else:
+            self.n_pruned += 1
+
+        self.trim()
+
+    def push_children(self, node: TreeNode, children, bound: int):
+        for child in children:
+            self.n_nodes += 1
+            self.n_live += 1
+            child.tracker = weakref.ref(child, self.release)
+
+            child_bound = max(bound, child.total_height)
+            if (child_bound >= self.incumbent.total_height):
+                self.n_pruned += 1
+                continue
+
+            child_score = child.total_height + child.remaining_height()
+            heapq.heappush(self.frontier, (child_bound, child_score, child))
+
+        # the search never goes back to a node's children, so drop them and
+        # let the ones that were not queued be freed
+        node.children.clear()
+        self.peak_nodes = max(self.peak_nodes, self.n_live)
 
-        heapq.heappush(self.visited, (score, node))
+    def release(self, tracker):
+        '''Called as a node is freed'''
+        self.n_live -= 1
 
-        if (len(node.strip.unplaced) == 0):
-            heapq.heappush(self.complete, (score, node))
+    def trim(self):
+        '''Cuts the frontier back to its best `max_frontier` nodes once it has grown to twice that'''
+        if (self.max_frontier is None or len(self.frontier) < 2 * self.max_frontier):
+            return
 
-        for child in node.expand():
-            child_score = child.strip.total_height + child.remaining_height()
-            heapq.heappush(self.frontier, (child_score, child))
+        # a sorted list is a valid heap; sorting on the scores alone skips TreeNode.__lt__
+        self.frontier.sort(key=lambda entry: entry[:2])
+        self.dropped = min(self.dropped, self.frontier[self.max_frontier][0])
+        self.n_dropped += len(self.frontier) - self.max_frontier
+        del self.frontier[self.max_frontier:]
 
-    def search(self, rounds) -> TreeNode | None:
+    def search(self, rounds) -> Strip:
         for _ in tqdm.tqdm(range(rounds)):
+            if (self.is_done()):
+                break
+            self.visit_best()
+
+        self.report()
+        return self.incumbent
+
+    def report(self):
+        print(f'{self.n_nodes} nodes, at most {self.peak_nodes} in memory; {self.n_pruned} bounded nodes pruned, {self.n_dropped} dropped from the frontier')
+        if (self.is_optimal()):
+            print(f'Optimal: height {self.incumbent.total_height}')
+        else:
+            print(f'Lower bound {self.best_bound()}, best height {self.incumbent.total_height}')
+
+    def iter_search(self, deadline, rounds=None):
+        '''
+        Anytime search: visits nodes until `deadline` (a time.time() value),
+        `rounds` visits, or the incumbent is proven optimal, and yields a
+        Strip for the first incumbent and every time a lower complete
+        packing is found
+        '''
+        best = self.incumbent
+        yield best
+
+        visits = 0
+        while not self.is_done() and time.time() < deadline and (rounds is None or visits < rounds):
             self.visit_best()
+            visits += 1
 
-        if (len(self.complete) == 0):
-            print(f'No solution found with {rounds} rounds')
-            return None
+            if (self.incumbent is not best):
+                best = self.incumbent
+                yield best
 
-        return self.complete[0][1].strip
+        self.report()
 
 class MCTS():
-    def __init__(self, problem: Problem):
+    def __init__(self, problem: Problem, rollout='skyline'):
         self.root = TreeNode(None, problem, None)
         self.exploration_factor = 1
+        self.rollout = rollout_policies[rollout]
+
+        # nodes by Zobrist key; placement orders that reach the same set of
+        # placements share one node, with its statistics and subtree
+        self.table = {self.root.key: self.root}
+        self.n_transpositions = 0
+
+        # lowest complete packing seen in any playout
+        self.best_height = math.inf
+        self.best_placements = None
+
+        self.n_playouts = 0
+        self.playout_time = 0
         
     def search(self, timeout) -> TreeNode:
         node = self.root
-        while (node.strip.unplaced):
-            print(f'placing box {len(node.strip.placements) + 1}/{self.root.strip.n_boxes}...')
-
-            sample_size = 5
-            avg = sum(MCTS.do_playout(node.strip).total_height for _ in range(sample_size)) / sample_size
-
-            start = datetime.datetime.now()
-            while (datetime.datetime.now() < start + datetime.timedelta(seconds=timeout)):
-                self.MC_round(node, avg)
-            
-            print([n.playouts for n in node.children])
-            node = sorted(node.children, key=lambda x: (x.playouts, -x.strip.total_height), reverse=True)[0]
-        
-        return node.strip
+        while (node.n_unplaced):
+            node = self.decide(node, timeout)
+
+        print(f'{self.n_playouts} playouts, {self.playouts_per_second():.0f} playouts/s')
+        print(f'{len(self.table)} nodes, {self.n_transpositions} transpositions shared')
+        return node.to_strip()
+
+    def playouts_per_second(self) -> float:
+        return self.n_playouts / self.playout_time if self.playout_time else 0
+
+    def iter_search(self, deadline, timeout=None):
+        '''
+        Anytime search: splits the time left before `deadline` evenly over the
+        remaining placements (or spends `timeout` on each one, if given) and
+        yields a Strip every time a playout or the chosen path finds a lower
+        packing. Stops early once the deadline has passed.
+        '''
+        best = math.inf
+        node = self.root
+        while (node.n_unplaced and time.time() < deadline):
+            budget = (deadline - time.time()) / node.n_unplaced
+            node = self.decide(node, min(budget, timeout) if timeout else budget)
+
+            if (self.best_height < best):
+                best = self.best_height
+                yield Strip(self.root.cursor.strip, self.best_placements)
+
+        if (node.n_unplaced == 0 and node.total_height < best):
+            yield node.to_strip()
+
+    def decide(self, node: TreeNode, timeout) -> TreeNode:
+        '''Runs MCTS rounds from `node` for `timeout` seconds (at least one) and returns the chosen child'''
+        print(f'placing box {node.depth + 1}/{self.root.n_unplaced}...')
+
+        n_playouts, elapsed = self.explore(node, timeout)
+
+        print(f'{n_playouts} playouts in {elapsed:.2f} seconds ({n_playouts / max(elapsed, 1e-6):.0f} playouts/s)')
+        print([n.playouts for n in node.children])
+        return sorted(node.children, key=lambda x: (x.playouts, -x.total_height), reverse=True)[0]
+
+    def explore(self, node: TreeNode, timeout) -> tuple[int, float]:
+        '''Runs MCTS rounds from `node` for `timeout` seconds (at least one) and returns the number of playouts and the time taken'''
+        sample_size = 5
+        avg = sum(self.playout(node) for _ in range(sample_size)) / sample_size
+
+        n_playouts = self.n_playouts
+        start = datetime.datetime.now()
+        while True:
+            self.MC_round(node, avg)
+            if (datetime.datetime.now() >= start + datetime.timedelta(seconds=timeout)):
+                break
+
+        return self.n_playouts - n_playouts, (datetime.datetime.now() - start).total_seconds()
+
+    def advance(self, node: TreeNode, placement: tuple[int, tuple[int, int]]) -> TreeNode:
+        '''Returns the node reached from `node` by `placement`, creating it if this tree never reached that state'''
+        key = node.key ^ node.zobrist(placement)
+        if (key not in self.table):
+            self.table[key] = TreeNode(node, None, placement)
+        return self.table[key]
 
     def MC_round(self, root, avg):
         curr = root
+        path = [root]
 
         # selection
-        while curr.strip.unplaced:
+        while curr.n_unplaced:
             try:
                 if (not curr.child_generator):
-                    curr.child_generator = curr.expand()
-                curr = next(curr.child_generator)
+                    curr.child_generator = curr.expand(self.table)
+                child = next(curr.child_generator)
+                if (child.parent is not curr):
+                    self.n_transpositions += 1
+                curr = child
+                path.append(curr)
                 break
             except StopIteration:
-                curr = sorted(curr.children, key=self.exploration_score, reverse=True)[0]
+                parent = curr
+                curr = sorted(curr.children, key=lambda child: self.exploration_score(child, parent), reverse=True)[0]
+                path.append(curr)
 
         # simulation
-        strip = MCTS.do_playout(curr.strip)
-        isWin = 1 if strip.total_height < avg else 0
-
-        # backpropagation
-        while (curr):
-            curr.playouts += 1
-            curr.wins += isWin
-            curr = curr.parent
+        height = self.playout(curr)
+        isWin = 1 if height < avg else 0
+
+        # backpropagation, along the path this round took (a shared node's
+        # parent may be on another path) and then up from the round's root
+        for node in path:
+            node.playouts += 1
+            node.wins += isWin
+
+        node = root.parent
+        while (node):
+            node.playouts += 1
+            node.wins += isWin
+            node = node.parent
+
+    def playout(self, node: TreeNode) -> int:
+        '''Runs one playout from `node`, remembering it if it beats every earlier one'''
+        start = time.perf_counter()
+        height, placements = MCTS.do_playout(node, self.best_height, self.rollout)
+        self.playout_time += time.perf_counter() - start
+        self.n_playouts += 1
+        stats.counters['playouts'] += 1
+
+        if (placements is not None):
+            self.best_height = height
+            self.best_placements = placements
+        return height
+
+    def do_playout(node: TreeNode, best=math.inf, rollout=random_rollout) -> tuple[int, dict | None]:
+        '''
+        Places the remaining boxes on the tree's shared strip with a rollout
+        policy, then undoes them again. Returns the height of the finished
+        strip, and a copy of its placements if that height is below `best`.
+        '''
+        strip = node.strip
+        placed = len(strip.unplaced)
+        rollout(strip)
 
-    def do_playout(strip: Strip):
-        cop = TreeNode(None, strip, strip.placements)
-        while (cop.strip.unplaced):
-            id, pos = random.choice(list(cop.possible_placements()))
-            cop.strip.place(id, pos)
-        return cop.strip
+        height = strip.total_height
+        placements = dict(strip.placements.items()) if height < best else None
+        for _ in range(placed):
+            strip.undo()
+        return height, placements
 
-    def exploration_score(self, node: TreeNode):
+    def exploration_score(self, node: TreeNode, parent: TreeNode | None = None):
         '''
         This function gives a node a score to determine whether or not it should be explored
         during MCTS. This allows MCTS to balance deep exploration of good paths vs. new
-        exploration.
+        exploration. `parent` is the node it is being selected from, which for
+        a shared node need not be node.parent.
         '''
         winrate = node.wins / node.playouts
 
-        if (node.parent):
-            ignored_factor = math.sqrt(math.log2(node.parent.playouts) / node.playouts)
+        parent = parent or node.parent
+        if (parent):
+            ignored_factor = math.sqrt(math.log2(parent.playouts) / node.playouts)
         else:
             ignored_factor = math.inf
 
         return winrate + self.exploration_factor * ignored_factor
 
-
-def run_tree_search(problem, rounds=100):
-    return Tree(problem).search(rounds)
-
-def run_MCTS(problem, timeout=2):
+def mcts_worker(conn, problem: Problem, rollout: str, seed: int):
+    '''
+    Keeps one MCTS tree for a RootParallelMCTS. Each message is the
+    placement chosen at the last decision (None at the start) and the time
+    to search; the reply is the visit counts of the current node's children,
+    the worker's best playout, if it improved, and its stats counters.
+    '''
+    random.seed(seed)
+    sys.stdout = sys.stderr
+    stats.counters.clear()      # inherited from the parent, which already has them
+
+    mcts = MCTS(problem, rollout)
+    node = mcts.root
+    reported = math.inf
+    while True:
+        message = conn.recv()
+        if (message is None):
+            break
+
+        placement, timeout = message
+        if (placement is not None):
+            node = mcts.advance(node, placement)
+
+        n_playouts, _ = mcts.explore(node, timeout)
+
+        best = None
+        if (mcts.best_height < reported):
+            reported = mcts.best_height
+            best = (mcts.best_height, mcts.best_placements)
+
+        children = [(child.placement_from(node), child.playouts, child.total_height) for child in node.children]
+        conn.send((children, n_playouts, best, stats.take()))
+
+class RootParallelMCTS():
+    '''
+    Root-parallel MCTS: every process searches its own tree from the current
+    node for the whole timeout, and the visit counts of the children are
+    summed across processes before choosing, so the playouts per decision
+    grow with the number of processes.
+    '''
+    def __init__(self, problem: Problem, rollout='skyline', cores=4):
+        self.problem = problem
+        self.rollout = rollout
+        self.cores = cores
+
+        self.best_height = math.inf
+        self.best_placements = None
+        self.n_playouts = 0
+
+    def search(self, timeout) -> Strip:
+        for _ in self.iter_search(math.inf, timeout):
+            pass
+        return Strip(self.problem, self.path)
+
+    def iter_search(self, deadline, timeout=None):
+        '''Like MCTS.iter_search, with every decision searched on all processes'''
+        connections = []
+        workers = []
+        for _ in range(self.cores):
+            conn, worker_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=mcts_worker,
+                args=(worker_conn, self.problem, self.rollout, random.getrandbits(32)),
+            )
+            worker.start()
+            # so recv() sees EOF instead of blocking if the worker dies
+            worker_conn.close()
+            connections.append(conn)
+            workers.append(worker)
+
+        self.path = {}
+        best = math.inf
+        placement = None
+        start = time.time()
+        try:
+            while len(self.path) < self.problem.n_boxes and time.time() < deadline:
+                n_unplaced = self.problem.n_boxes - len(self.path)
+                print(f'placing box {len(self.path) + 1}/{self.problem.n_boxes}...')
+
+                budget = (deadline - time.time()) / n_unplaced
+                for conn in connections:
+                    conn.send((placement, min(budget, timeout) if timeout else budget))
+
+                totals = {}
+                n_playouts = 0
+                decision_start = time.time()
+                for i, conn in enumerate(connections):
+                    try:
+                        children, playouts, found, counts = conn.recv()
+                    except EOFError:
+                        workers[i].join(timeout=1)
+                        raise RuntimeError(f'MCTS worker {i} exited with code {workers[i].exitcode}')
+                    n_playouts += playouts
+                    stats.merge(counts)
+                    for child, child_playouts, child_height in children:
+                        totals.setdefault(child, [0, child_height])[0] += child_playouts
+
+                    if (found is not None and found[0] < self.best_height):
+                        self.best_height, self.best_placements = found
+
+                elapsed = time.time() - decision_start
+                self.n_playouts += n_playouts
+                print(f'{n_playouts} playouts in {elapsed:.2f} seconds ({n_playouts / max(elapsed, 1e-6):.0f} playouts/s) on {self.cores} processes')
+
+                placement = max(totals.items(), key=lambda item: (item[1][0], -item[1][1]))[0]
+                self.path[placement[0]] = placement[1]
+
+                if (self.best_height < best):
+                    best = self.best_height
+                    yield Strip(self.problem, self.best_placements)
+        finally:
+            # a worker that died has closed its end of the pipe
+            for conn in connections:
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+            for worker in workers:
+                worker.join(timeout=1)
+                if (worker.is_alive()):
+                    worker.terminate()
+                    worker.join()
+
+        print(f'{self.n_playouts} playouts, {self.n_playouts / max(time.time() - start, 1e-6):.0f} playouts/s')
+
+        if (len(self.path) == self.problem.n_boxes):
+            strip = Strip(self.problem, self.path)
+            if (strip.total_height < best):
+                yield strip
+
+def run_tree_search(problem, rounds=100, max_frontier=None):
+    return Tree(problem, max_frontier).search(rounds)
+
+def run_MCTS(problem, timeout=2, rollout='skyline', cores=1):
     print(f'{timeout=}')
-    return MCTS(problem).search(timeout)
+    print(f'{rollout=}')
+    print(f'{cores=}')
+    if (cores > 1):
+        return RootParallelMCTS(problem, rollout, cores).search(timeout)
+    return MCTS(problem, rollout).search(timeout)
+
+def anytime_tree_search(problem, deadline, rounds=None, max_frontier=None):
+    yield from Tree(problem, max_frontier).iter_search(deadline, rounds)
+
+def anytime_MCTS(problem, deadline, timeout=None, rollout='skyline', cores=1):
+    if (cores > 1):
+        yield from RootParallelMCTS(problem, rollout, cores).iter_search(deadline, timeout)
+    else:
+        yield from MCTS(problem, rollout).iter_search(deadline, timeout)
 
 
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from strip import Strip
+
+class ActiveBoxes:
+    '''
+    The boxes crossed by the sweep line, as two Fenwick trees over the
+    distinct y edges: one counting box bottoms and one counting box tops
+    '''
+    def __init__(self, n_edges: int) -> None:
+        self.size = n_edges + 1
+        self.bottoms = [0] * self.size
+        self.tops = [0] * self.size
+
+    def add(self, bottom: int, top: int, delta: int) -> None:
+        '''Adds `delta` boxes spanning edges `bottom` to `top`'''
+        tree = self.bottoms
+        i = bottom + 1
+        while i < self.size:
+            tree[i] += delta
+            i += i & -i
+
+        tree = self.tops
+        i = top + 1
+        while i < self.size:
+            tree[i] += delta
+            i += i & -i
+
+    def overlapping(self, bottom: int, top: int) -> int:
+        '''
+        Number of boxes overlapping edges `bottom` to `top`: those starting
+        below `top`, less those ending at or below `bottom`
+        '''
+        count = 0
+        i = top
+        while i > 0:
+            count += self.bottoms[i]
+            i -= i & -i
+
+        i = bottom + 1
+        while i > 0:
+            count -= self.tops[i]
+            i -= i & -i
+
+        return count
+
+def verify_placements(width: int, placements) -> int:
+    '''
+    Checks a packing given as (id, (x, y), box width, box height) tuples:
+    every box is inside the strip, no id appears twice and no two boxes
+    overlap. Raises ValueError on the first problem found and returns the
+    height of the packing otherwise.
+
+    A line sweeps over x, taking boxes out at their right edge before
+    putting the ones starting there in, so boxes that only touch are fine.
+    Over y, the boxes the line crosses are counted in Fenwick trees (see
+    ActiveBoxes), so checking and adding each box takes O(log n).
+    '''
+    boxes = {}
+    for id, pos, w, h in placements:
+        if (id in boxes):
+            raise ValueError(f'box {id} is placed twice')
+        boxes[id] = (int(pos[0]), int(pos[1]), int(w), int(h))
+
+    if (not boxes):
+        return 0
+
+    ids = list(boxes)
+    x, y, w, h = np.array(list(boxes.values()), dtype=np.int64).T
+
+    outside = (x < 0) | (y < 0) | (x + w > width)
+    if (outside.any()):
+        id = ids[int(np.argmax(outside))]
+        raise ValueError(f'box {id} ({boxes[id][2]}x{boxes[id][3]} at {boxes[id][0]}, {boxes[id][1]}) is outside the strip of width {width}')
+
+    edges = np.unique(np.concatenate((y, y + h)))
+    bottoms = np.searchsorted(edges, y).tolist()
+    tops = np.searchsorted(edges, y + h).tolist()
+
+    # removals at an x sort before insertions there; event i < n inserts box i
+    n = len(ids)
+    order = np.argsort(np.concatenate((2 * x + 1, 2 * (x + w))), kind='stable').tolist()
+
+    active = ActiveBoxes(len(edges))
+    for event in order:
+        if (event >= n):
+            active.add(bottoms[event - n], tops[event - n], -1)
+            continue
+
+        if (active.overlapping(bottoms[event], tops[event]) > 0):
+            id = ids[event]
+            other = find_overlap(boxes, id)
+            raise ValueError(f'box {id} at {boxes[id][:2]} overlaps box {other} at {boxes[other][:2]}')
+
+        active.add(bottoms[event], tops[event], 1)
+
+    return int((y + h).max())
+
+def find_overlap(boxes: dict, id: int) -> int:
+    '''Returns a box overlapping `id`; only used to report an error, so a plain scan will do'''
+    x, y, w, h = boxes[id]
+    for other, (x2, y2, w2, h2) in boxes.items():
+        if (other != id and x < x2 + w2 and x2 < x + w and y < y2 + h2 and y2 < y + h):
+            return other
+
+def verify_strip(strip: Strip) -> None:
+    '''
+    Checks a finished strip: every box is placed, the packing is valid (see
+    verify_placements) and total_height is its actual height
+    '''
+    if (len(strip.unplaced) != 0):
+        raise ValueError(f'{len(strip.unplaced)} boxes are not placed, e.g. box {next(iter(strip.unplaced))}')
+
+    widths = strip.widths.tolist()
+    heights = strip.heights.tolist()
+    placements = ((id, pos, widths[id], heights[id]) for id, pos in strip.placements.items())
+    height = verify_placements(strip.width, placements)
+
+    if (height != strip.total_height):
+        raise ValueError(f'total height is {strip.total_height}, but the boxes reach {height}')